@@ -17,22 +17,26 @@ To use this dataset, the images need to be stored in the following structure:
 import os
 
 
-from PIL import Image
-import torch
 from torch.utils.data import Dataset
 from torchvision import transforms
-from torchvision.transforms.v2 import AugMix, Compose, Normalize, RandomHorizontalFlip, RandomRotation, Resize, ToDtype, ToImage
 from torch.utils.data import Dataset
 import pandas as pd
 
-class DataFrameDataset(Dataset):
+from .image_cache import ImageCache
+from .transforms import ImageTransformsMixin
+
+class DataFrameDataset(ImageTransformsMixin, Dataset):
+    rotation_degrees = 180
+
     def __init__(self, 
                  image_overview: pd.DataFrame,
                  data_dir: str,
                  train: bool = True, 
                  TTA: bool = False,
                  shuffle: bool = False,
-                 class_map: dict = None,):
+                 class_map: dict = None,
+                 gpu_decode: bool = False,
+                 image_cache: str = None):
         """ Initialisation of the DataframeDataSet
 
         Args:
@@ -40,12 +44,15 @@ class DataFrameDataset(Dataset):
             train: A bool to identitfy the train dataset
             TTA: A bool to enable test time augementation
             shuffle : Shuffle the data during loading
+            gpu_decode: Return the raw bytes of JPEG images to decode and augment them batch-wise on the GPU
+            image_cache: Optional path to a file to cache the resized images in between epochs
         """
         self.df = image_overview.copy()
         self.data_dir = data_dir
         self.train = train
         self.TTA = TTA
         self.shuffle = shuffle
+        self.gpu_decode = gpu_decode
         self.transforms = {}
         self._define_transforms()
         self.class_map = class_map 
@@ -53,18 +60,8 @@ class DataFrameDataset(Dataset):
 
         if self.shuffle:
             self.df = self.df.sample(frac=1).reset_index(drop=True)
-
-    def _define_transforms(self):
-        mean, std = [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]  # ImageNet mean and std #TODOchange it back to 30
-        self.train_transforms = Compose([ToImage(), RandomHorizontalFlip(), RandomRotation(180), AugMix(severity=6,mixture_width=5), Resize((224, 224)), ToDtype(torch.float32, scale=True), Normalize(mean, std)])
-        self.val_transforms = Compose([ToImage(), Resize((224, 224)), ToDtype(torch.float32, scale=True), Normalize(mean, std)])
-        if self.TTA:
-            self.rotations = {
-                "0": Compose([RandomRotation(0, 0)]),
-                "90": Compose([RandomRotation((90, 90))]),
-                "180": Compose([RandomRotation((180, 180))]),
-                "270": Compose([RandomRotation((270, 270))]),
-            }
+        # Created after the shuffle, row k of the cache always holds the image of row k of the dataframe
+        self.image_cache = ImageCache(image_cache, len(self)) if image_cache else None
 
     def __len__(self):
         return len(self.df)
@@ -76,21 +73,20 @@ class DataFrameDataset(Dataset):
             idx (int): The index to load
 
         Returns:
-            A dictionary with the image and labael. If TTA is enabled, it returns a dictionary of
-            the rotations.
+            A dictionary with the image and labael.
         """
         row = self.df.iloc[idx]
         label = row["class"]
         class_map = row["class_map"]
         image_path = os.path.join(self.data_dir ,label,row["image"])
 
-        # load the image
-        image = Image.open(image_path).convert("RGB")
-
-        if self.TTA:
-                image = {rot: self.val_transforms(self.rotations[rot](image)) for rot in self.rotations}
-        elif self.train:
-            image = self.train_transforms(image)
-        else:
-            image = self.val_transforms(image)
+        image = self.image_cache.get(idx) if self.image_cache is not None else None
+        if image is None:
+            # load the image
+            with open(image_path, "rb") as file:
+                image = self._decode_image(image_path, file.read())
+            # Raw JPEG bytes for the GPU decoding are not cached
+            if self.image_cache is not None and image.ndim == 3:
+                self.image_cache.put(idx, image)
+        image = self._transform_image(image)
         return image, class_map
@@ -6,15 +6,28 @@ import torch
 import pandas as pd
 from lightning import LightningDataModule
 from lightning.pytorch.utilities.combined_loader import CombinedLoader
-from torch.utils.data import DataLoader, Dataset, DistributedSampler, random_split
+from torch.utils.data import DataLoader, Dataset, DistributedSampler, IterableDataset, Subset, random_split
 
 from ..data.imagedataset import ImageFolderDataset
 from ..data.tardataset import TarImageDataset
 from ..data.dataframe_dataset import DataFrameDataset
-from ..helpers.helpers import TTA_collate_fn
+from ..data.sharded_dataset import ShardedTarDataset, is_shard_dir
+from ..data.transforms import ImageTransformsMixin
+from ..helpers.helpers import gpu_decode_collate_fn
 
 logger = logging.getLogger(__name__)
 
+
+def available_cpus() -> int:
+    """
+    Returns the number of CPUs this process may run on, e.g. the cores of a Slurm allocation,
+    which can be far fewer than the CPUs of the host reported by os.cpu_count.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
 class DataModule(LightningDataModule):
     """
     A LightningDataModule with PyTorch for handlin training routines compatible with the PyTorch Lightning framework.
@@ -60,8 +73,39 @@ class DataModule(LightningDataModule):
         self.priority_classes = priority_classes
         self.rest_classes = rest_classes
         self.use_multi = not kwargs.get("no_use_multi", False)
+        self.image_cache = kwargs.get("image_cache", None)
+        self.gpu_decode = kwargs.get("gpu_decode", False)
+        if self.image_cache and self.gpu_decode:
+            logger.warning("The image cache is disabled, with gpu_decode the JPEG images are decoded on the GPU in every epoch.")
+            self.image_cache = None
+        # DataLoader settings, by default the CPUs are shared evenly between the GPUs of the node
+        num_workers = kwargs.get("num_workers", None)
+        self.num_workers = num_workers if num_workers is not None else available_cpus() // max(torch.cuda.device_count(), 1)
+        self.prefetch_factor = kwargs.get("prefetch_factor", 4)
+        self.persistent_workers = not kwargs.get("no_persistent_workers", False)
+        # Threads per worker reading the images of a tar file, only the cores left idle by the workers are used
+        read_threads = kwargs.get("read_threads", None)
+        self.read_threads = read_threads if read_threads is not None else max(1, available_cpus() // max(torch.cuda.device_count(), 1) // max(self.num_workers, 1))
+        logger.info(
+            "DataLoader: %s workers, prefetch factor %s, persistent workers %s, %s read threads, pinned memory with non-blocking transfer.",
+            self.num_workers,
+            self.prefetch_factor,
+            self.persistent_workers,
+            self.read_threads,
+        )
         # Verify that class map exists for testing mode
 
+    @property
+    def rotation_degrees(self) -> float:
+        """
+        Range of the random rotation of the training images, which differs between the datasets.
+        The LitClassifier applies the same range to the images decoded on the GPU.
+        """
+        dataset = getattr(self, "train_dataset", None)
+        if isinstance(dataset, Subset):
+            dataset = dataset.dataset
+        return getattr(dataset, "rotation_degrees", ImageTransformsMixin.rotation_degrees)
+
     def setup(self, stage: Optional[Literal["predict"]] = None):
         """ Set up the correct dataset for the current stage of the model.
         Args:
@@ -76,7 +120,11 @@ class DataModule(LightningDataModule):
                 logger.info("Train size: %s", len(self.train_dataset))
                 logger.info("Validation size: %s", len(self.val_dataset))
                 logger.info("Test size: %s", len(self.test_dataset))
-                
+
+            elif is_shard_dir(self.datapath):
+                logger.debug("Setting up a dataset based on a sharded tar file.")
+                self.train_dataset, self.val_dataset, self.test_dataset = self.setup_from_shards()
+
             else:
                 if self.datapath.find(".tar") == -1:
                     logger.debug("Setting up a dataset based on an image folder.")
@@ -87,6 +135,8 @@ class DataModule(LightningDataModule):
                         rest_classes=self.rest_classes,
                         TTA=self.TTA,
                         train=True,
+                        image_cache=self.image_cache,
+                        gpu_decode=self.gpu_decode,
                     )
                 else:
                     logger.debug("Setting up a dataset based on a tar file.")
@@ -97,6 +147,9 @@ class DataModule(LightningDataModule):
                         rest_classes=self.rest_classes,
                         TTA=self.TTA,
                         train=True,
+                        image_cache=self.image_cache,
+                        gpu_decode=self.gpu_decode,
+                        read_threads=self.read_threads,
                     )
 
                 # Since no split overview is provided, create a random split of the dataset
@@ -142,6 +195,7 @@ class DataModule(LightningDataModule):
                     self.rest_classes,
                     TTA=self.TTA,
                     train=False,
+                    read_threads=self.read_threads,
                 )
 
     def create_random_split(self, 
@@ -170,6 +224,35 @@ class DataModule(LightningDataModule):
                 generator=torch.Generator().manual_seed(42),
             )
     
+    def setup_from_shards(self) -> tuple:
+        """
+        Set up the streaming datasets of a tar file repacked into shards.
+
+        The images keep the order of the original tar file, therefore the random split
+        selects the same images as for the TarImageDataset of the tar file.
+
+        Returns:
+            A tuple containing the different splits of the dataset.
+        """
+        if self.image_cache:
+            logger.warning("The image cache is not supported for sharded datasets and is not used.")
+        full_dataset = ShardedTarDataset(
+            self.datapath,
+            self.class_map,
+            self.priority_classes,
+            rest_classes=self.rest_classes,
+            TTA=self.TTA,
+            train=True,
+            gpu_decode=self.gpu_decode,
+            batch_size=self.batch_size,
+        )
+        train_split, val_split, test_split = self.create_random_split(full_dataset=range(len(full_dataset.labels)))
+        return (
+            full_dataset.subset(train_split.indices, train=True),
+            full_dataset.subset(val_split.indices, train=False),
+            full_dataset.subset(test_split.indices, train=False),
+        )
+
     def setup_from_overview(self)-> tuple:
         """
         Extract the datasets from the provided split overview
@@ -193,7 +276,9 @@ class DataModule(LightningDataModule):
         class_map=self.class_map,
         data_dir=self.datapath,
         train=True,
-        TTA=self.TTA
+        TTA=self.TTA,
+        gpu_decode=self.gpu_decode,
+        image_cache=self._split_cache_path("train"),
         )
 
         val_dataset = DataFrameDataset(
@@ -201,7 +286,9 @@ class DataModule(LightningDataModule):
             class_map=self.class_map,
             data_dir=self.datapath,
             train=False,
-            TTA=self.TTA
+            TTA=self.TTA,
+            gpu_decode=self.gpu_decode,
+            image_cache=self._split_cache_path("val"),
         )
 
         test_dataset = DataFrameDataset(
@@ -209,11 +296,34 @@ class DataModule(LightningDataModule):
             class_map=self.class_map,
             data_dir=self.datapath,
             train=False,
-            TTA=self.TTA
+            TTA=self.TTA,
+            gpu_decode=self.gpu_decode,
+            image_cache=self._split_cache_path("test"),
         )
 
         return train_dataset, val_dataset, test_dataset
 
+    def _split_cache_path(self, split: str) -> Optional[str]:
+        """
+        Returns the path of the image cache of one split of the split overview, every split needs its own file.
+        """
+        return f"{self.image_cache}.{split}" if self.image_cache else None
+
+    def _dataloader_kwargs(self) -> dict:
+        """Common arguments of the train, validation and test dataloaders.
+
+        Persistent workers keep the datasets (and their open file handles) alive between epochs and
+        pinned memory lets Lightning copy the batches to the GPU with non-blocking transfers.
+
+        Returns:
+            dict: Keyword arguments for the DataLoader.
+        """
+        kwargs = {"num_workers": self.num_workers, "pin_memory": True}
+        if self.num_workers > 0:
+            kwargs["persistent_workers"] = self.persistent_workers
+            kwargs["prefetch_factor"] = self.prefetch_factor
+        return kwargs
+
     def train_dataloader(self):
         """
         Constructs the DataLoader for training data.
@@ -225,11 +335,12 @@ class DataModule(LightningDataModule):
         return DataLoader(
             self.train_dataset,
             batch_size=self.batch_size,
-            shuffle=True,
+            # Streaming datasets shuffle themselves
+            shuffle=not isinstance(self.train_dataset, IterableDataset),
             sampler=None,
-            num_workers= 4,
-            pin_memory=True,
-            drop_last=True
+            **self._dataloader_kwargs(),
+            drop_last=True,
+            collate_fn=gpu_decode_collate_fn if self.gpu_decode else None,
         )
 
     def val_dataloader(self):
@@ -244,22 +355,10 @@ class DataModule(LightningDataModule):
                 batch_size=self.batch_size,
                 shuffle=False,
                 sampler=None,
-                num_workers= 4,
-                pin_memory=True,
+                **self._dataloader_kwargs(),
                 drop_last=False,
+                collate_fn=gpu_decode_collate_fn if self.gpu_decode else None,
             )
-        if self.TTA:
-                # Apply TTA collate function if TTA is enabled
-                loader = DataLoader(
-                    self.val_dataset,
-                    batch_size=self.batch_size,
-                    shuffle=False,
-                    sampler=None,
-                    num_workers= 4,
-                    pin_memory=True,
-                    drop_last=False,
-                    collate_fn=lambda x:TTA_collate_fn(x,True),
-                )
         return loader
 
     def test_dataloader(self):
@@ -268,26 +367,15 @@ class DataModule(LightningDataModule):
             DataLoader: DataLoader object for the testing dataset.
         """
 
-        if self.TTA:
-            loader = DataLoader(
-                self.test_dataset,
-                batch_size=self.batch_size,
-                shuffle=False,
-                sampler=None,
-                num_workers= 4,
-                pin_memory=True,
-                drop_last=False,
-                collate_fn=lambda x:TTA_collate_fn(x,True),
-            )
-        else:
-            loader = DataLoader(
-                self.test_dataset,
-                batch_size=self.batch_size,
-                shuffle=False,
-                num_workers= 4,
-                pin_memory=True,
-                drop_last=False,
-            )
+        # The TTA rotations are applied batch-wise on the GPU by the LitClassifier
+        loader = DataLoader(
+            self.test_dataset,
+            batch_size=self.batch_size,
+            shuffle=False,
+            **self._dataloader_kwargs(),
+            drop_last=False,
+            collate_fn=gpu_decode_collate_fn if self.gpu_decode else None,
+        )
         return loader
 
     def predict_dataloader(self):
@@ -304,7 +392,6 @@ class DataModule(LightningDataModule):
                 num_workers=8,
                 pin_memory=False,
                 drop_last=False,
-                collate_fn=lambda x:TTA_collate_fn(x,False) if self.TTA else None
             )
     
         return loader
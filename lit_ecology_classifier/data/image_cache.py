@@ -0,0 +1,67 @@
+"""
+Memory-mapped cache for the decoded and resized images of a dataset.
+
+The first access of an image decodes and resizes it as usual and stores the
+resulting uint8 tensor in a single memory-mapped file. Subsequent epochs read
+the image directly from the file and skip the decoding. The readiness of the
+rows is tracked in shared memory, so all forked DataLoader workers see the
+images cached by the others.
+"""
+
+import ctypes
+import logging
+import multiprocessing
+import os
+from typing import Optional
+
+import numpy as np
+import torch
+from torchvision import tv_tensors
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCache:
+    """
+    Cache of resized uint8 images backed by a memory-mapped file of shape (N, 3, H, W).
+
+    Attributes:
+        cache_path (str): Path to the file backing the cache.
+        shape (tuple): Shape of the cached array.
+    """
+
+    def __init__(self, cache_path: str, num_images: int, image_size: tuple = (224, 224)):
+        """
+        Initializes the cache file and the shared readiness bitmap.
+
+        Args:
+            cache_path (str): Path to the file backing the cache.
+            num_images (int): Number of images in the dataset.
+            image_size (tuple): Height and width of the cached images.
+        """
+        self.cache_path = cache_path
+        self.shape = (num_images, 3, *image_size)
+        n_bytes = int(np.prod(self.shape))
+
+        # Reuse an existing file of the right size instead of truncating it, other ranks may already use it
+        mode = "r+" if os.path.exists(cache_path) and os.path.getsize(cache_path) == n_bytes else "w+"
+        logger.info("Caching resized images in %s (%.1f GB).", cache_path, n_bytes / 1e9)
+        self._cache = np.memmap(cache_path, dtype=np.uint8, mode=mode, shape=self.shape)
+        # Rows are only trusted once they were written during this run
+        self._ready = multiprocessing.Array(ctypes.c_bool, num_images, lock=False)
+
+    def get(self, idx: int) -> Optional[tv_tensors.Image]:
+        """
+        Returns the cached image at the given index or None if it is not cached yet.
+        """
+        if not self._ready[idx]:
+            return None
+        # Copy the row, so that later transformations can never modify the cache
+        return tv_tensors.Image(torch.from_numpy(np.array(self._cache[idx])))
+
+    def put(self, idx: int, image: torch.Tensor):
+        """
+        Stores the resized uint8 image at the given index.
+        """
+        self._cache[idx] = image.numpy()
+        self._ready[idx] = True
@@ -3,20 +3,21 @@ import json
 import logging
 import os
 import pprint
-import random
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
-import torch
-from PIL import Image
+import numpy as np
 from torch.utils.data import Dataset
 from torchvision import transforms
-from torchvision.transforms.v2 import AugMix, Compose, Normalize, RandomHorizontalFlip, RandomRotation, Resize, ToDtype, ToImage
 
 from ..helpers.helpers import define_priority_classes, define_rest_classes
+from .image_cache import ImageCache
+from .index_file import load_index, save_index
+from .transforms import ImageTransformsMixin
 
 
-class ImageFolderDataset(Dataset):
+class ImageFolderDataset(ImageTransformsMixin, Dataset):
     """
     A Dataset subclass for managing and accessing image data stored in folders. This class supports optional
     image transformations, and Test Time Augmentation (TTA) for enhancing model evaluation during testing.
@@ -27,9 +28,13 @@ class ImageFolderDataset(Dataset):
         priority_classes (str): Path to a JSON file specifying priority classes for targeted training or evaluation.
         train (bool): Specifies whether the dataset will be used for training. Determines the type of transformations applied.
         TTA (bool): Indicates if Test Time Augmentation should be applied during testing.
+        image_cache (ImageCache): Optional cache of the resized images, reused across epochs.
+        gpu_decode (bool): If True, JPEG images are returned as raw bytes to be decoded on the GPU.
     """
 
-    def __init__(self, data_dir: str, class_map: dict, priority_classes: list, rest_classes: list, TTA: bool = False, train: bool = False):
+    rotation_degrees = 30
+
+    def __init__(self, data_dir: str, class_map: dict, priority_classes: list, rest_classes: list, TTA: bool = False, train: bool = False, image_cache: str = None, gpu_decode: bool = False):
         """
         Initializes the ImageFolderDataset with paths and modes.
 
@@ -40,6 +45,9 @@ class ImageFolderDataset(Dataset):
             rest_classes (list): A list of rest classes.
             train (bool): A flag to indicate if the dataset is used for training purposes.
             TTA (bool): A flag to enable Test Time Augmentation.
+            image_cache (str): Optional path to a file to cache the resized images in between epochs.
+            gpu_decode (bool): Return the raw bytes of JPEG images and the resized but not normalized
+                uint8 tensor of other images, to decode and augment them batch-wise on the GPU.
         """
         self.data_dir = data_dir
         self.TTA = TTA
@@ -47,12 +55,17 @@ class ImageFolderDataset(Dataset):
         self.train = train
         self.priority_classes = priority_classes
         self.rest_classes = rest_classes
+        self.gpu_decode = gpu_decode
         # Transformation sequences for training and validation/testing
         self._define_transforms()
         # Load image information from the folder structure
         self.image_infos = self._load_image_infos()
         if rest_classes != []:
             self._filter_rest_classes()
+        self.labels = self._load_labels()
+        # Order in which the images are accessed, shuffled instead of the image list itself
+        self._perm = np.arange(len(self.image_infos), dtype=np.int32)
+        self.image_cache = ImageCache(image_cache, len(self)) if image_cache else None
 
 
     def _filter_rest_classes(self):
@@ -67,33 +80,6 @@ class ImageFolderDataset(Dataset):
         logging.info(f"Filtered dataset to {len(self.image_infos)} samples.")
 
 
-    def _define_transforms(self):
-        """ Defines the image transformations for training and validation/testing.
-
-        The training transformations include:
-            - RandomHorizontalFlip: Randomly flips the image horizontally.
-            - RandomRotation: Randomly rotates the image by a specified angle.
-            - AugMix: Applies AugMix data augmentation.
-            - Resize: Resizes the image to a specified size.
-            - ToDtype: Converts the image to a torch.Tensor of a floating-point data type.
-
-        
-        
-        
-        """
-        mean, std = [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]  # ImageNet mean and std
-        
-        self.train_transforms = Compose([ToImage(), RandomHorizontalFlip(), RandomRotation(30), AugMix(), Resize((224, 224)), ToDtype(torch.float32, scale=True), Normalize(mean, std)])
-        
-        self.val_transforms = Compose([ToImage(), Resize((224, 224)), ToDtype(torch.float32, scale=True), Normalize(mean, std)])
-        if self.TTA:
-            self.rotations = {
-                "0": Compose([RandomRotation(0, 0)]),
-                "90": Compose([RandomRotation((90, 90))]),
-                "180": Compose([RandomRotation((180, 180))]),
-                "270": Compose([RandomRotation((270, 270))]),
-            }
-
     def __len__(self):
         """
         Returns the total number of images in the dataset.
@@ -113,30 +99,103 @@ class ImageFolderDataset(Dataset):
         Returns:
             tuple: A tuple containing the transformed image and its label.
         """
+        idx = int(self._perm[idx])
         image_path = self.image_infos[idx]
-        image = Image.open(image_path).convert("RGB")
-
-        # Apply TTA transformations if enabled
-        if self.TTA:
-            image = {rot: self.val_transforms(self.rotations[rot](image)) for rot in self.rotations}
-        elif self.train:
-            image = self.train_transforms(image)
-        else:
-            image = self.val_transforms(image)
+        label = int(self.labels[idx])
+        image = self.image_cache.get(idx) if self.image_cache is not None else None
+        if image is None:
+            with open(image_path, "rb") as file:
+                image = self._decode_image(image_path, file.read())
+            # Raw JPEG bytes for the GPU decoding are not cached
+            if self.image_cache is not None and image.ndim == 3:
+                self.image_cache.put(idx, image)
+        image = self._transform_image(image)
 
-        label = self.get_label_from_filename(image_path)
         return image, label
 
     def _load_image_infos(self):
         """
-        Load image information from the folder structure.
+        Load image information from the folder structure. The list of images is built once and
+        stored next to the folder, later runs load it as long as none of the scanned folders changed.
+        """
+        index = load_index(self.data_dir, os.path.getmtime(self.data_dir))
+        if not self._index_is_current(index):
+            index = self._scan_class_folders()
+            save_index(self.data_dir, index)
+        relative_paths, _ = index
+        return [os.path.join(self.data_dir, path) for path in relative_paths]
+
+    def _index_is_current(self, index):
+        """
+        Checks that no folder of the index was modified since it was scanned. Adding or removing an image
+        or a sub folder updates the modification time of its parent folder, which is part of the index.
+
+        Args:
+            index: The loaded index, a tuple of the image paths and the modification time of every scanned folder.
+
+        Returns:
+            bool: True if the index can be used instead of scanning the folders again.
+        """
+        if not isinstance(index, tuple) or len(index) != 2:
+            return False
+        try:
+            return all(os.stat(os.path.join(self.data_dir, folder)).st_mtime == mtime for folder, mtime in index[1].items())
+        except OSError:
+            return False
+
+    def _scan_class_folders(self):
+        """
+        Lists the images of all class folders in parallel. Listing a folder is bound by the latency
+        of the file system (e.g. on NFS or Lustre) and threads release the GIL while waiting for it.
+
+        Returns:
+            tuple: The paths of the images relative to the data directory and a dictionary
+                with the modification time of every scanned folder, relative to the data directory.
+        """
+        image_paths, class_folders = [], []
+        folder_mtimes = {"": os.stat(self.data_dir).st_mtime}
+        with os.scandir(self.data_dir) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    class_folders.append(entry)
+                elif entry.name.lower().endswith(("jpg", "jpeg", "png")):
+                    image_paths.append(entry.name)
+
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            for class_image_paths, class_folder_mtimes in executor.map(lambda entry: self._scan_folder(entry.path, entry.name), class_folders):
+                image_paths.extend(class_image_paths)
+                folder_mtimes.update(class_folder_mtimes)
+        return image_paths, folder_mtimes
+
+    def _scan_folder(self, folder, prefix):
+        """
+        Recursively lists the images in the given folder with os.scandir. Symbolic links to
+        folders are not followed, like os.walk, so that a link loop cannot recurse forever.
+
+        Returns:
+            tuple: The paths of the images and the modification times of the scanned folders, relative to the data directory.
+        """
+        image_paths = []
+        # Taken before listing, so that images added during the scan invalidate the index
+        folder_mtimes = {prefix: os.stat(folder).st_mtime}
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    sub_image_paths, sub_folder_mtimes = self._scan_folder(entry.path, os.path.join(prefix, entry.name))
+                    image_paths.extend(sub_image_paths)
+                    folder_mtimes.update(sub_folder_mtimes)
+                elif entry.name.lower().endswith(("jpg", "jpeg", "png")):
+                    image_paths.append(os.path.join(prefix, entry.name))
+        return image_paths, folder_mtimes
+
+    def _load_labels(self):
+        """
+        Computes the label index of every image once, to avoid parsing the filenames per sample.
+
+        Returns:
+            np.ndarray: The int32 label index of each image.
         """
-        image_infos = []
-        for root, _, files in os.walk(self.data_dir):
-            for file in files:
-                if file.lower().endswith(("jpg", "jpeg", "png")):
-                    image_infos.append(os.path.join(root, file))
-        return image_infos
+        return np.fromiter((self.get_label_from_filename(path) for path in self.image_infos), dtype=np.int32, count=len(self.image_infos))
 
     def get_label_from_filename(self, filename):
         """
@@ -157,6 +216,7 @@ class ImageFolderDataset(Dataset):
 
     def shuffle(self):
         """
-        Shuffles the list of image information to randomize data access, useful during training.
+        Shuffles the access order of the images to randomize data access, useful during training.
+        The image list itself keeps its order, so image k always stays in row k of the image cache.
         """
-        random.shuffle(self.image_infos)
+        np.random.shuffle(self._perm)
@@ -0,0 +1,68 @@
+"""
+Persistence of the image index of a dataset next to the dataset itself.
+
+Listing the images of a large folder tree or parsing all headers of a large tar
+file can take minutes. The resulting index is therefore pickled to
+``<dataset>.index.pkl`` and reused as long as the dataset was not modified since.
+"""
+
+import logging
+import os
+import pickle
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def index_path_for(data_path: str) -> str:
+    """
+    Returns the path of the index file belonging to the given tar file or folder.
+    """
+    return os.path.normpath(data_path) + ".index.pkl"
+
+
+def load_index(data_path: str, mtime: float) -> Optional[Any]:
+    """
+    Loads the index of the given dataset if it exists and is newer than the dataset.
+
+    Args:
+        data_path (str): Path to the tar file or folder containing the images.
+        mtime (float): Last modification time of the dataset.
+
+    Returns:
+        The unpickled index or None if no up-to-date index exists.
+    """
+    index_path = index_path_for(data_path)
+    if not os.path.exists(index_path) or os.path.getmtime(index_path) < mtime:
+        return None
+    try:
+        with open(index_path, "rb") as file:
+            index = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError) as error:
+        logger.warning("Could not load the index file %s: %s", index_path, error)
+        return None
+    logger.info("Loaded the image index from %s.", index_path)
+    return index
+
+
+def save_index(data_path: str, index: Any):
+    """
+    Saves the index of the given dataset next to it. Failures, e.g. on a read-only storage, are only logged.
+
+    Args:
+        data_path (str): Path to the tar file or folder containing the images.
+        index: The picklable index to save.
+    """
+    index_path = index_path_for(data_path)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as file:
+            pickle.dump(index, file, protocol=pickle.HIGHEST_PROTOCOL)
+        # Atomic replace, so that concurrent processes never read a partially written file
+        os.replace(tmp_path, index_path)
+    except OSError as error:
+        logger.warning("Could not save the index file %s: %s", index_path, error)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    logger.info("Saved the image index to %s.", index_path)
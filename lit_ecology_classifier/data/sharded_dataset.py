@@ -0,0 +1,358 @@
+"""
+Streaming dataset over a tar file repacked into shards.
+
+Random reads at the offsets of one large tar file are slow on network file systems and HDDs.
+``repack_tar`` shuffles the images of such a tar file once and splits them into shards of about 1 GB,
+which ``ShardedTarDataset`` reads strictly sequentially. The shards are plain tar files with the original
+member names, so they stay readable by WebDataset and other tar based tools. A manifest next to the shards
+stores the number of images, the class and the index in the original tar file of every image, so the
+dataset knows its size, labels and split without opening a shard.
+"""
+
+import itertools
+import logging
+import os
+import random
+import tarfile
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from ..helpers.json_io import dump_json, load_json
+from .transforms import ImageTransformsMixin
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+IMAGE_EXTENSIONS = ("jpg", "jpeg", "png")
+
+
+def is_shard_dir(path: str) -> bool:
+    """
+    Returns True if the path is a directory with shards created by repack_tar.
+    """
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST_NAME))
+
+
+def load_manifest(shard_dir: str) -> dict:
+    """
+    Loads the manifest of the shards in the given directory.
+
+    Args:
+        shard_dir (str): Directory containing the shards and their manifest.
+
+    Returns:
+        dict: The class names and, for each shard, its file name, image count and the class ids and tar indices of its images.
+    """
+    return load_json(os.path.join(shard_dir, MANIFEST_NAME))
+
+
+def repack_tar(tar_path: str, shard_dir: str, shard_size: int = 10**9, seed: int = 0) -> dict:
+    """
+    Splits the images of a tar file in a random order into shards of about shard_size bytes.
+
+    The training tar files are sorted by class and the shards are streamed sequentially, so the images are
+    shuffled while they are written, otherwise every batch would hold the images of one or two classes.
+    The manifest stores the index of every image in the tar file, which the sharded dataset uses to split
+    the images exactly like the TarImageDataset of the tar file. Each image of the tar file is read once,
+    at a random position.
+
+    Args:
+        tar_path (str): Path to the tar file with the images in class folders.
+        shard_dir (str): Directory to write the shards and the manifest to.
+        shard_size (int): Size in bytes after which a new shard is started.
+        seed (int): Seed of the random order of the images.
+
+    Returns:
+        dict: The manifest of the written shards.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    prefix = os.path.splitext(os.path.basename(os.path.normpath(tar_path)))[0]
+    class_ids = {}
+    shards = []
+    shard, shard_bytes = None, 0
+
+    with tarfile.open(tar_path, "r:") as source:
+        members = [member for member in source.getmembers() if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS)]
+        # The class ids are numbered in the order of the tar file, independent of the shuffling
+        member_class_ids = [class_ids.setdefault(os.path.basename(os.path.dirname(member.name)), len(class_ids)) for member in members]
+        for index in np.random.default_rng(seed).permutation(len(members)):
+            member = members[index]
+            if shard is None or shard_bytes >= shard_size:
+                if shard is not None:
+                    shard.close()
+                shards.append({"url": f"{prefix}-{len(shards):06d}.tar", "count": 0, "class_ids": [], "indices": []})
+                shard = tarfile.open(os.path.join(shard_dir, shards[-1]["url"]), "w")
+                shard_bytes = 0
+                logger.info("Writing shard %s.", shards[-1]["url"])
+            shard.addfile(member, source.extractfile(member))
+            shards[-1]["count"] += 1
+            shards[-1]["class_ids"].append(member_class_ids[index])
+            shards[-1]["indices"].append(int(index))
+            shard_bytes += member.size
+    if shard is not None:
+        shard.close()
+
+    manifest = {"source": os.path.basename(tar_path), "classes": list(class_ids), "shards": shards}
+    dump_json(manifest, os.path.join(shard_dir, MANIFEST_NAME))
+    logger.info("Repacked %s images into %s shards.", sum(shard["count"] for shard in shards), len(shards))
+    return manifest
+
+
+class ShardedTarDataset(ImageTransformsMixin, IterableDataset):
+    """
+    An IterableDataset streaming the images of the shards created by repack_tar.
+
+    During training, every DDP process reads its own subset of the shards, which its DataLoader workers split
+    into contiguous ranges of whole batches. The shards hold the images in a random order. They are additionally
+    read in a random order, each worker draws its images from several open shards at once and passes them through
+    a shuffle buffer. All processes yield the same number of full batches per epoch, as DDP requires.
+
+    For evaluation, every process reads every n-th image of all shards instead, padded with repeated images to
+    the same count like the DistributedSampler, so that every image is evaluated.
+
+    The positions of the dataset, e.g. those selected by random_split, follow the order of the images in the
+    original tar file, so the splits contain the same images as the splits of the TarImageDataset.
+
+    Attributes:
+        shard_dir (str): Directory containing the shards and their manifest.
+        train (bool): Specifies whether the dataset will be used for training. Determines the type of transformations applied.
+        TTA (bool): Indicates if Test Time Augmentation should be applied during testing.
+        gpu_decode (bool): If True, JPEG images are returned as raw bytes to be decoded on the GPU.
+        shuffle_buffer (int): Number of images the training images are shuffled within.
+        interleave_shards (int): Number of shards each worker reads from at the same time during training.
+        batch_size (int): Batch size of the DataLoader, the workers split the images in whole batches.
+        labels (np.ndarray): The int32 label index of each selected image.
+    """
+
+    def __init__(self, shard_dir: str, class_map: dict, priority_classes: list, rest_classes: list, TTA: bool = False, train: bool = False, gpu_decode: bool = False, shuffle_buffer: int = 1000, batch_size: int = 1, interleave_shards: int = 4):
+        """
+        Initializes the ShardedTarDataset from the manifest of the shards.
+
+        Args:
+            shard_dir (str): Directory containing the shards and their manifest.
+            class_map (dict): Mapping of the class names to the label indices.
+            priority_classes (list): Priority classes, all other classes are mapped to the label 0.
+            rest_classes (list): If not empty, only the images of these classes are used.
+            TTA (bool): A flag to enable Test Time Augmentation.
+            train (bool): A flag to indicate if the dataset is used for training purposes.
+            gpu_decode (bool): Return the raw bytes of JPEG images and the resized but not normalized
+                uint8 tensor of other images, to decode and augment them batch-wise on the GPU.
+            shuffle_buffer (int): Number of images the training images are shuffled within.
+            batch_size (int): Batch size of the DataLoader, the workers split the images in whole batches.
+            interleave_shards (int): Number of shards each worker reads from at the same time during training.
+        """
+        self.shard_dir = shard_dir
+        self.TTA = TTA
+        self.train = train
+        self.gpu_decode = gpu_decode
+        self.shuffle_buffer = shuffle_buffer
+        self.batch_size = batch_size
+        self.interleave_shards = interleave_shards
+        # Number of epochs iterated by this copy of the dataset, see _epoch_seed
+        self._epoch = 0
+        self._define_transforms()
+
+        manifest = load_manifest(shard_dir)
+        self.shards = [shard["url"] for shard in manifest["shards"]]
+        # Position of the first image of each shard in the stream of all shards
+        counts = np.array([shard["count"] for shard in manifest["shards"]], dtype=np.int64)
+        self._shard_starts = np.concatenate([[0], np.cumsum(counts)])
+        class_ids = np.concatenate([np.asarray(shard["class_ids"], dtype=np.int32) for shard in manifest["shards"]] or [np.zeros(0, dtype=np.int32)])
+        # Index of every image in the original tar file, the shards of older versions kept the order of the tar file
+        tar_indices = np.concatenate([
+            np.asarray(shard.get("indices", np.arange(start, start + shard["count"])), dtype=np.int64)
+            for start, shard in zip(self._shard_starts, manifest["shards"])
+        ] or [np.zeros(0, dtype=np.int64)])
+
+        # The same class selection and label mapping as the TarImageDataset
+        class_names = manifest["classes"]
+        if priority_classes != []:
+            class_labels = np.array([class_map.get(name, 0) for name in class_names], dtype=np.int32)
+        else:
+            class_labels = np.array([class_map.get(name, -1) for name in class_names], dtype=np.int32)
+        keep = np.ones(len(class_ids), dtype=bool)
+        if rest_classes != []:
+            logging.info(f"Filtering dataset to keep only classes in {rest_classes}")
+            keep = np.isin(class_ids, [i for i, name in enumerate(class_names) if name in rest_classes])
+        # Stream positions of the selected images in the order of the tar file, the dataset positions refer to this array
+        selected = np.flatnonzero(keep)
+        self._indices = selected[np.argsort(tar_indices[selected], kind="stable")]
+        self.labels = class_labels[class_ids[self._indices]]
+        if (self.labels < 0).any():
+            missing = sorted({class_names[i] for i in class_ids[self._indices][self.labels < 0]})
+            raise KeyError(f"Classes {missing} are missing in the class map.")
+        self._sort_stream()
+
+    def _sort_stream(self):
+        """
+        Orders the selected images and their labels by their stream position, the order in which the shards are read.
+        """
+        order = np.argsort(self._indices, kind="stable")
+        self._stream_indices = self._indices[order]
+        self._stream_labels = self.labels[order]
+
+    def subset(self, positions, train: bool = None) -> "ShardedTarDataset":
+        """
+        Returns a copy of the dataset restricted to the images at the given positions, e.g. one split of random_split.
+
+        Args:
+            positions: Positions of the images in this dataset.
+            train (bool): Training flag of the subset, by default the flag of this dataset.
+
+        Returns:
+            ShardedTarDataset: The dataset with the selected images.
+        """
+        positions = np.sort(np.asarray(positions, dtype=np.int64))
+        subset = object.__new__(ShardedTarDataset)
+        subset.__dict__.update(self.__dict__)
+        subset._indices = self._indices[positions]
+        subset.labels = self.labels[positions]
+        subset._sort_stream()
+        if train is not None:
+            subset.train = train
+        return subset
+
+    @staticmethod
+    def _get_rank():
+        """
+        Returns the rank and the number of the DDP processes, (0, 1) without DDP.
+        """
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            return torch.distributed.get_rank(), torch.distributed.get_world_size()
+        return 0, 1
+
+    def _shard_counts(self) -> np.ndarray:
+        """
+        Returns the number of selected images in each shard.
+        """
+        return np.diff(np.searchsorted(self._stream_indices, self._shard_starts))
+
+    def _rank_quota(self, world_size: int) -> int:
+        """
+        Returns the number of images every DDP process yields per epoch, the count of the smallest process.
+        """
+        if world_size > len(self.shards):
+            raise ValueError(f"{len(self.shards)} shards cannot be split between {world_size} processes, repack the tar file into smaller shards.")
+        counts = self._shard_counts()
+        return min(int(counts[rank::world_size].sum()) for rank in range(world_size))
+
+    def _rank_length(self, world_size: int) -> int:
+        """
+        Returns the number of images every DDP process yields per epoch. For training with DDP, the quota is cut
+        to whole batches, so that every process yields the same number of batches with or without drop_last.
+        For evaluation, the images are split evenly between the processes and the last round is padded.
+        """
+        if not self.train:
+            return -(-len(self._stream_indices) // world_size)
+        quota = self._rank_quota(world_size)
+        return quota if world_size == 1 else quota // self.batch_size * self.batch_size
+
+    def __len__(self):
+        """
+        Returns the number of images the current DDP process yields per epoch.
+
+        Returns:
+            int: The number of images.
+        """
+        return self._rank_length(self._get_rank()[1])
+
+    def _epoch_seed(self, worker_info) -> str:
+        """
+        Returns the seed of the shard order, which all DataLoader workers of the process share and which changes every epoch.
+        """
+        if worker_info is None:
+            return str(int(torch.randint(2**62, ()).item()))
+        # The workers are seeded with a common base seed plus their id. The base seed only changes when the workers
+        # are started, which persistent workers are once, therefore every copy of the dataset counts its epochs
+        self._epoch += 1
+        return f"{worker_info.seed - worker_info.id}-{self._epoch}"
+
+    def _read_shard(self, shard: int, positions: np.ndarray, labels: np.ndarray):
+        """
+        Reads one shard sequentially and yields the images at the given sorted stream positions with their labels,
+        repeated positions are yielded repeatedly.
+        The data of the skipped images is seeked over, only their headers are read.
+        """
+        selected = positions - self._shard_starts[shard]
+        position, k = 0, 0
+        with tarfile.open(os.path.join(self.shard_dir, self.shards[shard]), "r:") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                if position == selected[k]:
+                    image = self._decode_image(member.name, tar.extractfile(member).read())
+                    # The images repeated to pad the evaluation of the DDP processes are yielded again
+                    while k < len(selected) and selected[k] == position:
+                        yield self._transform_image(image), int(labels[k])
+                        k += 1
+                    if k == len(selected):
+                        return
+                position += 1
+
+    def _shard_readers(self, positions: np.ndarray, labels: np.ndarray) -> list:
+        """
+        Returns one lazy reader per run of consecutive images of the same shard, the images of a run are sorted.
+        """
+        shards = np.searchsorted(self._shard_starts, positions, side="right") - 1
+        bounds = np.concatenate([[0], np.flatnonzero(np.diff(shards)) + 1, [len(positions)]])
+        return [self._read_shard(int(shards[first]), positions[first:last], labels[first:last]) for first, last in zip(bounds[:-1], bounds[1:]) if last > first]
+
+    def _interleave(self, readers: list, rng: random.Random):
+        """
+        Yields the images of all readers, drawing every image at random from one of interleave_shards open readers.
+        """
+        pending = iter(readers)
+        active = list(itertools.islice(pending, max(self.interleave_shards, 1)))
+        while active:
+            k = rng.randrange(len(active))
+            try:
+                yield next(active[k])
+            except StopIteration:
+                replacement = next(pending, None)
+                if replacement is None:
+                    active.pop(k)
+                else:
+                    active[k] = replacement
+
+    def __iter__(self):
+        rank, world_size = self._get_rank()
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+
+        length = self._rank_length(world_size)
+        if self.train:
+            # Disjoint shards per process, read by all its workers in the same order
+            shards = list(np.arange(rank, len(self.shards), world_size))
+            random.Random(self._epoch_seed(worker_info)).shuffle(shards)
+            shard_bounds = np.searchsorted(self._stream_indices, self._shard_starts)
+            order = np.concatenate([np.arange(shard_bounds[shard], shard_bounds[shard + 1]) for shard in shards] or [np.zeros(0, dtype=np.int64)])
+        else:
+            # Every world_size-th image per process, the first images are repeated to fill up the last round
+            order = np.sort(np.resize(np.arange(len(self._stream_indices)), length * world_size)[rank::world_size])
+
+        # Each worker reads a contiguous range of whole batches of the images of the process
+        num_batches = -(-length // self.batch_size)
+        first = num_batches * worker_id // num_workers * self.batch_size
+        last = min(num_batches * (worker_id + 1) // num_workers * self.batch_size, length)
+        order = order[first:last]
+        readers = self._shard_readers(self._stream_indices[order], self._stream_labels[order])
+
+        if not self.train:
+            for reader in readers:
+                yield from reader
+            return
+        # The torch generator is seeded differently for every worker and epoch
+        rng = random.Random(int(torch.randint(2**62, ()).item()))
+        samples = self._interleave(readers, rng)
+        if self.shuffle_buffer <= 1:
+            yield from samples
+            return
+        buffer = []
+        for sample in samples:
+            buffer.append(sample)
+            if len(buffer) >= self.shuffle_buffer:
+                yield buffer.pop(rng.randrange(len(buffer)))
+        rng.shuffle(buffer)
+        yield from buffer
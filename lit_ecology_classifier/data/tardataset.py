@@ -1,24 +1,62 @@
-import io
 import json
 import logging
 import os
 import pprint
-import random
 import tarfile
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
+import numpy as np
 import torch
-from PIL import Image
 from torch.utils.data import Dataset
 from torchvision import transforms
-from torchvision.transforms.v2 import AugMix, Compose, Normalize, RandomHorizontalFlip, RandomRotation, Resize, ToDtype, ToImage
 
 from ..helpers.helpers import define_priority_classes, define_rest_classes
+from .image_cache import ImageCache
+from .index_file import load_index, save_index
+from .transforms import ImageTransformsMixin
 from typing import Any
 
 
-class TarImageDataset(Dataset):
+class PackedNames:
+    """
+    Read-only sequence of strings stored in one contiguous UTF-8 buffer with an int64 offset array.
+
+    Millions of separate str objects cost far more memory than their characters and their reference
+    counts dirty the copy-on-write pages shared with the forked DataLoader workers.
+    """
+
+    def __init__(self, names: list):
+        encoded = [name.encode("utf-8") for name in names]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(name) for name in encoded], out=self.offsets[1:])
+        self.buffer = b"".join(encoded)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("PackedNames index out of range")
+        return self.buffer[self.offsets[idx]:self.offsets[idx + 1]].decode("utf-8")
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def select(self, mask: np.ndarray) -> "PackedNames":
+        """
+        Returns the names at the positions where the boolean mask is True.
+        """
+        return PackedNames([name for name, keep in zip(self, mask) if keep])
+
+
+class TarImageDataset(ImageTransformsMixin, Dataset):
     """
     A Dataset subclass for managing and accessing image data stored in tar files. This class supports optional
     image transformations, and Test Time Augmentation (TTA) for enhancing model evaluation during testing.
@@ -29,9 +67,12 @@ class TarImageDataset(Dataset):
         priority_classes (str): Path to a JSON file specifying priority classes for targeted training or evaluation.
         train (bool): Specifies whether the dataset will be used for training. Determines the type of transformations applied.
         TTA (bool): Indicates if Test Time Augmentation should be applied during testing.
+        image_cache (ImageCache): Optional cache of the resized images, reused across epochs.
+        gpu_decode (bool): If True, JPEG images are returned as raw bytes to be decoded on the GPU.
+        read_threads (int): Number of threads reading and decoding the images of a batch concurrently.
     """
 
-    def __init__(self, tar_path: str,class_map: dict, priority_classes:list, rest_classes:list, TTA: bool = False, train: bool = False):
+    def __init__(self, tar_path: str,class_map: dict, priority_classes:list, rest_classes:list, TTA: bool = False, train: bool = False, image_cache: str = None, gpu_decode: bool = False, read_threads: int = 1):
         """
         Initializes the TarImageDataset with paths and modes.
 
@@ -41,6 +82,10 @@ class TarImageDataset(Dataset):
             priority_classes (str): The file path to the JSON file that contains priority classes.
             train (bool): A flag to indicate if the dataset is used for training purposes.
             TTA (bool): A flag to enable Test Time Augmentation.
+            image_cache (str): Optional path to a file to cache the resized images in between epochs.
+            gpu_decode (bool): Return the raw bytes of JPEG images and the resized but not normalized
+                uint8 tensor of other images, to decode and augment them batch-wise on the GPU.
+            read_threads (int): Number of threads reading and decoding the images of a batch concurrently.
         """
         self.tar_path = tar_path
         self.TTA = TTA
@@ -48,13 +93,25 @@ class TarImageDataset(Dataset):
         self.train = train
         self.priority_classes = priority_classes
         self.rest_classes = rest_classes
+        self.gpu_decode = gpu_decode
         # Transformation sequences for training and validation/testing
         self._define_transforms()
-        # Load image information from the tar file
-        self.image_infos = self._load_image_infos()
+        # Load the offset index of the images in the tar file
+        self.names, self.offsets, self.sizes = self._load_image_infos()
         if rest_classes!=[] and train:
             self._filter_rest_classes()
         self.train=train
+        # Labels are only returned for training, the class map may not cover the images to predict
+        self.labels = self._load_labels() if train else None
+        # Order in which the images are accessed, shuffled instead of the index itself
+        self._perm = np.arange(len(self.names), dtype=np.int32)
+        # Raw file descriptors of the tar file, opened lazily per DataLoader worker
+        self._fd_cache = {}
+        # Thread pool for the batched reads, created lazily per process
+        self.read_threads = read_threads
+        self._pool = None
+        self._pool_pid = None
+        self.image_cache = ImageCache(image_cache, len(self)) if image_cache else None
 
 
 
@@ -64,25 +121,11 @@ class TarImageDataset(Dataset):
         Removes samples that are not in rest_classes from the dataset.
         """
         logging.info(f"Filtering dataset to keep only classes in {self.rest_classes}")
-        filtered_image_infos = []
-        for image_info in self.image_infos:
-            class_name = os.path.basename(os.path.dirname(image_info.name))
-            if class_name in self.rest_classes:
-                filtered_image_infos.append(image_info)
-        self.image_infos = filtered_image_infos
-        logging.info(f"Filtered dataset to {len(self.image_infos)} samples.")
-
-    def _define_transforms(self):
-        mean, std = [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]  # ImageNet mean and std
-        self.train_transforms = Compose([ToImage(), RandomHorizontalFlip(), RandomRotation(180), AugMix(), Resize((224, 224)), ToDtype(torch.float32, scale=True), Normalize(mean, std)])
-        self.val_transforms = Compose([ToImage(), Resize((224, 224)), ToDtype(torch.float32, scale=True), Normalize(mean, std)])
-        if self.TTA:
-            self.rotations = {
-                "0": Compose([RandomRotation(0, 0)]),
-                "90": Compose([RandomRotation((90, 90))]),
-                "180": Compose([RandomRotation((180, 180))]),
-                "270": Compose([RandomRotation((270, 270))]),
-            }
+        keep = np.array([os.path.basename(os.path.dirname(name)) in self.rest_classes for name in self.names], dtype=bool)
+        self.names = self.names.select(keep)
+        self.offsets = self.offsets[keep]
+        self.sizes = self.sizes[keep]
+        logging.info(f"Filtered dataset to {len(self.names)} samples.")
 
     def __len__(self):
         """
@@ -91,7 +134,71 @@ class TarImageDataset(Dataset):
         Returns:
             int: The total number of images.
         """
-        return len(self.image_infos)
+        return len(self.names)
+
+    def __getstate__(self):
+        # File descriptors are only valid in the process that opened them
+        state = self.__dict__.copy()
+        state["_fd_cache"] = {}
+        # Neither are the threads of the pool
+        state["_pool"] = None
+        state["_pool_pid"] = None
+        return state
+
+    def __del__(self):
+        """
+        Closes the file descriptors and the thread pool opened by this process.
+        """
+        pool = getattr(self, "_pool", None)
+        if pool is not None and self._pool_pid == os.getpid():
+            pool.shutdown(wait=False)
+        for fd in getattr(self, "_fd_cache", {}).values():
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._fd_cache = {}
+
+    def _get_fd(self):
+        """
+        Returns a read-only file descriptor of the tar file for the current DataLoader worker.
+        """
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else None
+        fd = self._fd_cache.get(worker_id)
+        if fd is None:
+            fd = os.open(self.tar_path, os.O_RDONLY)
+            # Threads of the same worker may race here, keep the first descriptor and close the others
+            kept_fd = self._fd_cache.setdefault(worker_id, fd)
+            if kept_fd != fd:
+                os.close(fd)
+            fd = kept_fd
+        return fd
+
+    def _get_pool(self):
+        """
+        Returns the thread pool for the batched reads of the current process.
+        """
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ThreadPoolExecutor(max_workers=self.read_threads)
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def __getitems__(self, indices):
+        """
+        Retrieves all images of a batch at once. The DataLoader calls this method instead of __getitem__
+        for every index. The reads and the decoding release the GIL, so the images of the batch are
+        loaded concurrently by the threads of the pool.
+
+        Args:
+            indices (list): The indices of the images of the batch.
+
+        Returns:
+            list: The samples of the batch, as returned by __getitem__.
+        """
+        if self.read_threads <= 1 or len(indices) <= 1:
+            return [self[idx] for idx in indices]
+        return list(self._get_pool().map(self.__getitem__, indices))
 
     def __getitem__(self, idx):
         """
@@ -103,36 +210,56 @@ class TarImageDataset(Dataset):
         Returns:
             tuple: A tuple containing the transformed image and its label.
         """
-        with tarfile.open(self.tar_path, "r") as tar:
-            image_info = self.image_infos[idx]
-            image_file = tar.extractfile(image_info)
-            image = Image.open(io.BytesIO(image_file.read())).convert("RGB")
-            # Apply TTA transformations if enabled
-            if self.TTA:
-                image = {rot: self.val_transforms(self.rotations[rot](image)) for rot in self.rotations}
-            elif self.train:
-                image = self.train_transforms(image)
-            else:
-                image = self.val_transforms(image)
-            if self.train:
-                label = self.get_label_from_filename(image_info.name)
-                return image, label
-            else:
-                return image
+        idx = int(self._perm[idx])
+        image = self.image_cache.get(idx) if self.image_cache is not None else None
+        if image is None:
+            # Read the raw image bytes directly at their offset, no tar parsing needed
+            buffer = os.pread(self._get_fd(), int(self.sizes[idx]), int(self.offsets[idx]))
+            image = self._decode_image(self.names[idx], buffer)
+            # Raw JPEG bytes for the GPU decoding are not cached
+            if self.image_cache is not None and image.ndim == 3:
+                self.image_cache.put(idx, image)
+        image = self._transform_image(image)
+        if self.train:
+            label = int(self.labels[idx])
+            return image, label
+        else:
+            return image
 
     def _load_image_infos(self):
         """
-        Load image information from the tar file.
+        Load the name, data offset and size of each image in the tar file. The index is built once
+        and stored next to the tar file, later runs load it as long as the tar file is unchanged.
+
+        Returns:
+            tuple: The packed member names and two int64 arrays with the data offsets and sizes.
         """
-        image_infos = []
+        index = load_index(self.tar_path, os.path.getmtime(self.tar_path))
+        if index is not None and isinstance(index[0], PackedNames):
+            return index
+
+        names, offsets, sizes = [], [], []
         with tarfile.open(self.tar_path, "r") as tar:
             for member in tar.getmembers():
                 if member.isfile() and member.name.lower().endswith(("jpg", "jpeg", "png")):
-                    image_infos.append(member)
-        return image_infos
+                    names.append(member.name)
+                    offsets.append(member.offset_data)
+                    sizes.append(member.size)
+        index = PackedNames(names), np.array(offsets, dtype=np.int64), np.array(sizes, dtype=np.int64)
+        save_index(self.tar_path, index)
+        return index
 
 
 
+    def _load_labels(self):
+        """
+        Computes the label index of every image once, to avoid parsing the filenames per sample.
+
+        Returns:
+            np.ndarray: The int32 label index of each image.
+        """
+        return np.fromiter((self.get_label_from_filename(name) for name in self.names), dtype=np.int32, count=len(self.names))
+
     def get_label_from_filename(self, filename):
         """
         Extracts the label index from a given filename.
@@ -153,6 +280,7 @@ class TarImageDataset(Dataset):
 
     def shuffle(self):
         """
-        Shuffles the list of image information to randomize data access, useful during training.
+        Shuffles the access order of the images to randomize data access, useful during training.
+        The index itself keeps its order, so image k always stays in row k of the image cache.
         """
-        random.shuffle(self.image_infos)
+        np.random.shuffle(self._perm)
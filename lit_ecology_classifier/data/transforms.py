@@ -0,0 +1,200 @@
+"""
+Custom image transformations shared by the datasets.
+"""
+
+import io
+
+import torch
+from PIL import Image
+from torchvision.io import ImageReadMode, decode_jpeg
+from torchvision.transforms.v2 import Compose, InterpolationMode, RandomHorizontalFlip, RandomRotation, Resize, ToImage
+from torchvision.transforms.v2 import functional as F
+
+
+class FusedNormalize:
+    """
+    Converts a uint8 image to float32 and normalizes it in a single pass.
+
+    Equivalent to ToDtype(torch.float32, scale=True) followed by Normalize(mean, std), but computes
+    y = x * 1 / (max_value * std) - mean / std with one fused multiply-add, without an intermediate float image.
+    Works on single images (C, H, W) and batches (N, C, H, W) on any device.
+    """
+
+    def __init__(self, mean: list, std: list, max_value: float = 255.0):
+        """
+        Args:
+            mean (list): Mean of each channel.
+            std (list): Standard deviation of each channel.
+            max_value (float): Value of a white pixel, 255 for uint8 images and 1 for float images.
+        """
+        self.mean = mean
+        self.std = std
+        self.max_value = max_value
+        self.scale = torch.tensor([1.0 / (max_value * s) for s in std], dtype=torch.float32).view(3, 1, 1)
+        self.bias = torch.tensor([-m / s for m, s in zip(mean, std)], dtype=torch.float32).view(3, 1, 1)
+
+    def __call__(self, image: torch.Tensor) -> torch.Tensor:
+        if self.scale.device != image.device:
+            self.scale = self.scale.to(image.device)
+            self.bias = self.bias.to(image.device)
+        return torch.addcmul(self.bias, image.as_subclass(torch.Tensor), self.scale)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(mean={self.mean}, std={self.std}, max_value={self.max_value})"
+
+
+class RandomFlipRotateBatch:
+    """
+    Randomly flips every image of a batch horizontally and rotates it by a random angle in [-degrees, degrees].
+
+    Batched equivalent of RandomHorizontalFlip followed by RandomRotation(degrees) of the datasets. The flip and
+    the rotation of each image are folded into one affine sampling grid, so the whole batch is transformed by a
+    single grid_sample call. Areas outside of the rotated image are filled with black. Holds no tensors of its own,
+    therefore adding it to a model leaves the state dict unchanged.
+    """
+
+    def __init__(self, degrees: float):
+        """
+        Args:
+            degrees (float): Maximum absolute rotation angle in degrees.
+        """
+        self.degrees = degrees
+
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            images (torch.Tensor): Batch of uint8 images (N, C, H, W).
+
+        Returns:
+            torch.Tensor: The transformed uint8 images.
+        """
+        n, _, height, width = images.shape
+        angles = torch.deg2rad((torch.rand(n, device=images.device) * 2 - 1) * self.degrees)
+        flips = torch.where(torch.rand(n, device=images.device) < 0.5, -1.0, 1.0)
+        cos, sin = torch.cos(angles), torch.sin(angles)
+        # Rotation in pixel units, expressed in the normalized coordinates of affine_grid, with the x axis mirrored for flipped images
+        theta = torch.zeros(n, 2, 3, device=images.device)
+        theta[:, 0, 0] = cos * flips
+        theta[:, 0, 1] = -sin * height / width
+        theta[:, 1, 0] = sin * width / height * flips
+        theta[:, 1, 1] = cos
+        grid = torch.nn.functional.affine_grid(theta, list(images.shape), align_corners=False)
+        images = torch.nn.functional.grid_sample(images.float(), grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+        return images.round_().to(torch.uint8)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(degrees={self.degrees})"
+
+
+def decode_image_batch(images: list, device: torch.device, size: tuple = (224, 224)) -> torch.Tensor:
+    """
+    Decodes and resizes a batch of images on the given device.
+
+    The raw JPEG bytes of the batch are decoded with a single batched decode_jpeg call, which uses nvJPEG
+    on CUDA devices. Images which are already decoded uint8 tensors (C, H, W) are only resized. The resize
+    matches the one of the datasets, bilinear without antialiasing.
+
+    Args:
+        images (list): One dimensional uint8 tensors with JPEG bytes or decoded uint8 images, all on the CPU.
+        device (torch.device): The device to decode the images on.
+        size (tuple): Height and width of the resized images.
+
+    Returns:
+        torch.Tensor: The resized uint8 images stacked to a (N, 3, H, W) tensor on the device.
+    """
+    images = list(images)
+    jpeg_indices = [i for i, image in enumerate(images) if image.ndim == 1]
+    if jpeg_indices:
+        decoded = decode_jpeg([images[i] for i in jpeg_indices], mode=ImageReadMode.RGB, device=device)
+        for i, image in zip(jpeg_indices, decoded):
+            images[i] = image
+    return torch.stack([
+        F.resize(image.to(device, non_blocking=True), list(size), interpolation=F.InterpolationMode.BILINEAR, antialias=False)
+        for image in images
+    ])
+
+
+class ImageTransformsMixin:
+    """
+    Decoding and transformation of the images, shared by the datasets.
+
+    The datasets set the attributes train, TTA and gpu_decode and call _define_transforms in their __init__.
+    The training images are rotated randomly by up to rotation_degrees, the classes override it to change the range.
+    """
+
+    rotation_degrees = 180
+
+    def _define_transforms(self):
+        """
+        Defines the image transformations for training and validation/testing.
+
+        Every image is first resized to 224x224 by the resize transformations, so that
+        the augmentations and the normalization only operate on the small uint8 image.
+        The decoder already downscaled the image close to that size, therefore the resize
+        uses plain bilinear interpolation without antialiasing.
+
+        The training transformations include:
+            - RandomHorizontalFlip: Randomly flips the image horizontally.
+            - RandomRotation: Randomly rotates the image by up to rotation_degrees.
+
+        The training images stay uint8, the colour augmentation and the normalization run batch-wise on the GPU
+        in the LitClassifier. The validation transformations normalize the image with the ImageNet mean and std.
+
+        The transformations are only built by the properties below on first use, i.e. inside each DataLoader
+        worker. Objects built in the main process would be shared copy-on-write with the forked workers and
+        the reference counting of the workers would copy their memory pages.
+        """
+        self._resize_transforms = None
+        self._train_transforms = None
+        self._val_transforms = None
+
+    @property
+    def resize_transforms(self):
+        if self._resize_transforms is None:
+            self._resize_transforms = Compose([ToImage(), Resize((224, 224), interpolation=InterpolationMode.BILINEAR, antialias=False)])
+        return self._resize_transforms
+
+    @property
+    def train_transforms(self):
+        if self._train_transforms is None:
+            self._train_transforms = Compose([RandomHorizontalFlip(), RandomRotation(self.rotation_degrees)])
+        return self._train_transforms
+
+    @property
+    def val_transforms(self):
+        if self._val_transforms is None:
+            mean, std = [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]  # ImageNet mean and std
+            self._val_transforms = Compose([FusedNormalize(mean, std)])
+        return self._val_transforms
+
+    def _decode_image(self, name: str, buffer: bytes) -> torch.Tensor:
+        """
+        Decodes the raw bytes of an image and resizes it.
+
+        Args:
+            name (str): File name of the image, its extension selects the decoder.
+            buffer (bytes): The content of the image file.
+
+        Returns:
+            torch.Tensor: The resized uint8 image (3, 224, 224), or with gpu_decode the one
+                dimensional uint8 tensor of the bytes of a JPEG image to decode on the GPU.
+        """
+        if self.gpu_decode and name.lower().endswith(("jpg", "jpeg")):
+            # Return the raw bytes, the JPEG is decoded batch-wise on the GPU
+            return torch.frombuffer(bytearray(buffer), dtype=torch.uint8)
+        image = Image.open(io.BytesIO(buffer))
+        # Let the JPEG decoder downscale via DCT scaling, no-op for other formats
+        image.draft("RGB", (224, 224))
+        return self.resize_transforms(image.convert("RGB"))
+
+    def _transform_image(self, image: torch.Tensor) -> torch.Tensor:
+        """
+        Applies the training or validation transformations to an image returned by _decode_image.
+        """
+        if self.gpu_decode:
+            # The images join the GPU decoded images for augmentation and normalization
+            return image.as_subclass(torch.Tensor)
+        elif self.train and not self.TTA:
+            # The rotations of TTA are applied batch-wise on the GPU
+            return self.train_transforms(image)
+        return self.val_transforms(image)
@@ -7,15 +7,17 @@ The following parsers are included:
 - inference_argparser: Arguments for using the classifier on unlabeled data (predict.py).
 - overview_argparser: Arguments for creating a data overview for the given dataset (overview.py).
 - split_argparser: Arguments for the split process (split.py).
+- repack_argparser: Arguments for repacking a tar file into shards (repack.py).
 """
 import argparse
-import json
 import logging
 import os
 from typing import Union
 
 from typeguard import typechecked
 
+from .json_io import load_json
+
 logger = logging.getLogger(__name__)
 @typechecked
 def base_args():
@@ -61,6 +63,12 @@ def args_for_train():
     parser.add_argument("--main_param_path", default="./params/", help="Main directory where the training parameters are stored")
     parser.add_argument("--use_wandb", action="store_true", help="Use Weights and Biases for logging")
     parser.add_argument("--no_use_multi", action="store_true", help="Use multiple GPUs for training")
+    parser.add_argument("--image_cache", type=str, default=None, help="Path to a file to cache the resized images in between epochs. If empty, no cache is used")
+    parser.add_argument("--gpu_decode", action="store_true", help="Decode and augment the JPEG images batch-wise on the GPU instead of in the DataLoader workers")
+    parser.add_argument("--num_workers", type=int, default=None, help="Number of DataLoader workers per GPU. If empty, the CPUs are split evenly between the GPUs")
+    parser.add_argument("--prefetch_factor", type=int, default=4, help="Number of batches loaded in advance by each DataLoader worker")
+    parser.add_argument("--read_threads", type=int, default=None, help="Number of threads per DataLoader worker reading the images of a tar file. If empty, the CPUs not used by the workers are split between them")
+    parser.add_argument("--no_persistent_workers", action="store_true", help="Restart the DataLoader workers every epoch")
     
     # Model configuration and training options
     parser.add_argument("--balance_classes", action="store_true", help="Balance the classes for training")
@@ -69,6 +77,7 @@ def args_for_train():
     parser.add_argument("--lr", type=float, default=1e-2, help="Learning rate for training")
     parser.add_argument("--lr_factor", type=float, default=0.01, help="Learning rate factor for training of full body")
     parser.add_argument("--no_gpu", action="store_true", help="Use no GPU for training, default is False")
+    parser.add_argument("--precision", type=str, default=None, help="Precision of the Trainer, e.g. bf16-mixed or 32-true. If empty, bf16-mixed is used on GPUs with native bf16 support, 16-mixed on older GPUs and 32-true on the CPU")
     parser.add_argument("--loss", choices=["cross_entropy", "focal"], default="cross_entropy", help="Loss function to use")
 
     # Augmentation and training/testing specifics
@@ -113,6 +122,8 @@ def train_argparser():
         Learning rate factor for training of full body. Default is 0.01.
     --no_gpu: flag
         Use no GPU for training. Default is False.
+    --precision: str
+        Precision of the Trainer. Default is bf16-mixed on GPUs with native bf16 support, 16-mixed on older GPUs and 32-true on the CPU.
     --testing: flag
         Set this to True if in testing mode, False for training. Default is False.
 
@@ -197,6 +208,28 @@ def argparser():
     )
     return parser
 
+@typechecked
+def repack_argparser():
+    """
+    Creates an argument parser for repacking a tar file into shards for sequential streaming (repack.py).
+
+    Arguments:
+    --datapath: str
+        Path to the tar file containing the images.
+    --outpath: str
+        Directory where the shards and their manifest are saved.
+    --shard_size: float
+        Size of a shard in GB. Default is 1.
+
+    Returns:
+        argparse.ArgumentParser: The argument parser with defined arguments.
+    """
+    parser = argparse.ArgumentParser(description="Repack a tar file into shards, which are read sequentially during training.")
+    parser.add_argument("--datapath", required=True, help="Path to the tar file containing the images")
+    parser.add_argument("--outpath", required=True, help="Directory where the shards and their manifest are saved")
+    parser.add_argument("--shard_size", type=float, default=1.0, help="Size of a shard in GB")
+    return parser
+
 @typechecked
 def load_dict(input: Union[str, dict, None]) -> dict:
     """Load the training arguments from a JSON file.
@@ -221,8 +254,7 @@ def load_dict(input: Union[str, dict, None]) -> dict:
         if not os.path.exists(input):
             raise argparse.ArgumentTypeError(f"{input} file not found.")
         
-        with open(input) as file:
-            return json.load(file)
+        return load_json(input)
         
     raise argparse.ArgumentTypeError(f"{input} is not a path to a JSON file or dict containing the args.")
 
@@ -238,8 +270,7 @@ def load_class_definitions(input: Union[str, list[str]]) -> list[str] :
         if not os.path.exists(input):
             raise argparse.ArgumentTypeError(f"{input} file not found.")
         
-        with open(input) as file:
-            class_dict = json.load(file)
+        class_dict = load_json(input)
         
         # check if priority_classes key exists
         if "priority_classes" in class_dict:
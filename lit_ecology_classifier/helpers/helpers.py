@@ -15,7 +15,11 @@ import tarfile
 import os
 import importlib
 import re
+from concurrent.futures import ThreadPoolExecutor
 from typeguard import typechecked
+
+from ..data.sharded_dataset import is_shard_dir, load_manifest
+
 logger = logging.getLogger(__name__)
 
 
@@ -68,8 +72,6 @@ def output_results(outpath, im_names, labels, scores,priority_classes=False,rest
     labels = labels.tolist()
     base_filename = f"{outpath}/predictions_lit_ecology_classifier"+("_priority" if priority_classes else "")+("_rest" if rest_classes else "")
     file_path = f"{base_filename}.txt"
-    if tar_file:
-        im_names = [img.name for img in im_names]
     lines = [f"{img}------------------ {label}/{score}\n" for img, label,score in zip(im_names, labels,scores)]
     with open(file_path, "w+") as f:
         f.writelines(lines)
@@ -228,35 +230,22 @@ def plot_score_distributions(all_scores, all_preds, class_names, true_label):
     fig.tight_layout()
     return fig
 
-@typechecked
-def TTA_collate_fn(batch: dict , train: bool = False):
+
+def gpu_decode_collate_fn(batch: list):
     """
-    Collate function for test time augmentation (TTA).
+    Collate function for images that are decoded on the GPU.
+    The raw JPEG bytes differ in length and can not be stacked, so the images are kept as a list.
 
     Args:
-        batch (dict): Dict of tuples containing images and labels.
+        batch (list): List of tuples containing the raw or decoded images and labels.
 
     Returns:
-        batch_images: All rotations stacked row-wise
+        batch_images: List of the image tensors
         batch_labels: Labels of the images
     """
-    batch_images = {rot: [] for rot in ["0", "90", "180", "270"]}
-    batch_labels = []
-    if train:
-        for rotated_images, label in batch:
-            for rot in batch_images:
-                batch_images[rot].append(rotated_images[rot])
-            batch_labels.append(label)
-        batch_images = {rot: torch.stack(batch_images[rot]) for rot in batch_images}
-        batch_labels = torch.tensor(batch_labels)
-        return batch_images, batch_labels
+    batch_images, batch_labels = zip(*batch)
+    return list(batch_images), torch.tensor(batch_labels)
 
-    else:
-        for rotated_images in batch:
-            for rot in batch_images:
-                batch_images[rot].append(rotated_images[rot])
-        batch_images = {rot: torch.stack(batch_images[rot]) for rot in batch_images}
-        return batch_images
 
 
 
@@ -299,6 +288,26 @@ def plot_loss_acc(logger):
     fig.tight_layout()
     plt.savefig(f"{logger.save_dir}/{logger.name}/version_{logger.version}/loss_accuracy.png")
 
+def default_precision(no_gpu: bool = False) -> str:
+    """
+    Returns the default precision of the Trainer for the available hardware.
+
+    bf16 autocast is only fast on GPUs with native bf16 support (Ampere and newer). Older GPUs,
+    e.g. P100 or V100, train with float16 autocast instead, CPUs in full float32 precision.
+
+    Args:
+        no_gpu (bool): True if the training runs on the CPU.
+
+    Returns:
+        str: The precision argument of the Trainer.
+    """
+    if no_gpu or not torch.cuda.is_available():
+        return "32-true"
+    if torch.cuda.is_bf16_supported(including_emulation=False):
+        return "bf16-mixed"
+    return "16-mixed"
+
+
 def setup_callbacks(priority_classes, ckpt_name):
     """
     Sets up callbacks for the training process.
@@ -371,65 +380,6 @@ def setup_classmap(datapath="", priority_classes=[], rest_classes=[]):
     return class_map
 
 
-def _extract_class_map(tar_or_dir_path):
-    """
-    Extracts the class map from the contents of the tar file or directory and saves it to a JSON file.
-
-    Arguments:
-    tar_or_dir_path: str
-        Path to the tar file or directory containing the images.
-
-    Returns:
-    dict
-        A dictionary mapping class names to indices.
-    """
-    logging.info("Extracting class map.")
-    class_map = {}
-
-    if tarfile.is_tarfile(tar_or_dir_path):
-        logging.info("Detected tar file.")
-        with tarfile.open(tar_or_dir_path, "r") as tar:
-            # Temporary set to track folders that contain images
-            folders_with_images = set()
-
-            # First pass: Identify folders containing images
-            for member in tar.getmembers():
-                if member.isdir():
-                    continue  # Skip directories
-                if member.isfile() and member.name.lower().endswith(("jpg", "jpeg", "png")):
-                    class_name = os.path.basename(os.path.dirname(member.name))
-                    folders_with_images.add(class_name)
-
-            # Second pass: Build the class map only for folders with images
-            for member in tar.getmembers():
-                if member.isdir():
-                    continue  # Skip directories
-                class_name = os.path.basename(os.path.dirname(member.name))
-                if class_name in folders_with_images:
-                    if class_name not in class_map:
-                        class_map[class_name] = []
-                    class_map[class_name].append(member.name)
-
-    elif os.path.isdir(tar_or_dir_path):
-        logging.info("Detected directory.")
-        for root, _, files in os.walk(tar_or_dir_path):
-            for file in files:
-                if file.lower().endswith(("jpg", "jpeg", "png")):
-                    class_name = os.path.basename(root)
-                    if class_name not in class_map:
-                        class_map[class_name] = []
-                    class_map[class_name].append(os.path.join(root, file))
-
-    else:
-        raise ValueError("Provided path is neither a valid tar file nor a directory.")
-
-    # Create a sorted list of class names and map them to indices
-    sorted_class_names = sorted(class_map.keys())
-    logging.info(f"Found {len(sorted_class_names)} classes.")
-    class_map = {class_name: idx for idx, class_name in enumerate(sorted_class_names)}
-
-    return class_map
-
 def compute_roc_auc(all_labels, all_scores, debug=False): #debug logs some figures in a debug folder
     import matplotlib.pyplot as plt
     from sklearn.metrics import roc_auc_score, roc_curve
@@ -749,7 +699,8 @@ def filter_class_mapping(
 
 def _extract_class_map(tar_or_dir_path):
     """
-    Extracts the class map from the contents of the tar file or directory and saves it to a JSON file.
+    Extracts the class map from the contents of the tar file or directory.
+    The classes are the names of the folders containing images.
 
     Arguments:
     tar_or_dir_path: str
@@ -760,53 +711,48 @@ def _extract_class_map(tar_or_dir_path):
         A dictionary mapping class names to indices.
     """
     logger.info("Extracting class map.")
-    class_map = {}
 
-    if tarfile.is_tarfile(tar_or_dir_path):
-        logger.info("Detected tar file.")
-        with tarfile.open(tar_or_dir_path, "r") as tar:
-            # Temporary set to track folders that contain images
-            folders_with_images = set()
-
-            # First pass: Identify folders containing images
-            for member in tar.getmembers():
-                if member.isdir():
-                    continue  # Skip directories
-                if member.isfile() and member.name.lower().endswith(("jpg", "jpeg", "png")):
-                    class_name = os.path.basename(os.path.dirname(member.name))
-                    folders_with_images.add(class_name)
-
-            # Second pass: Build the class map only for folders with images
-            for member in tar.getmembers():
-                if member.isdir():
-                    continue  # Skip directories
-                class_name = os.path.basename(os.path.dirname(member.name))
-                if class_name in folders_with_images:
-                    if class_name not in class_map:
-                        class_map[class_name] = []
-                    class_map[class_name].append(member.name)
+    if is_shard_dir(tar_or_dir_path):
+        logger.info("Detected sharded tar file.")
+        class_names = set(load_manifest(tar_or_dir_path)["classes"])
 
     elif os.path.isdir(tar_or_dir_path):
         logger.info("Detected directory.")
-        for root, _, files in os.walk(tar_or_dir_path):
-            for file in files:
-                if file.lower().endswith(("jpg", "jpeg", "png")):
-                    class_name = os.path.basename(root)
-                    if class_name not in class_map:
-                        class_map[class_name] = []
-                    class_map[class_name].append(os.path.join(root, file))
+        # Only the class folders are needed, not the full file tree
+        with os.scandir(tar_or_dir_path) as entries:
+            class_folders = [entry for entry in entries if entry.is_dir()]
+        # Checking the folders is bound by the file system latency, so they are checked in parallel
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            has_images = list(executor.map(lambda entry: _contains_image(entry.path), class_folders))
+        class_names = {entry.name for entry, has_image in zip(class_folders, has_images) if has_image}
+
+    elif tarfile.is_tarfile(tar_or_dir_path):
+        logger.info("Detected tar file.")
+        with tarfile.open(tar_or_dir_path, "r") as tar:
+            class_names = {
+                os.path.basename(os.path.dirname(member.name)) for member in tar.getmembers()
+                if member.isfile() and member.name.lower().endswith(("jpg", "jpeg", "png"))
+            }
 
     else:
         raise ValueError("Provided path is neither a valid tar file nor a directory.")
 
     # Create a sorted list of class names and map them to indices
-    sorted_class_names = sorted(class_map.keys())
+    sorted_class_names = sorted(class_names)
     logger.info(f"Found {len(sorted_class_names)} classes.")
     class_map = {class_name: idx for idx, class_name in enumerate(sorted_class_names)}
     logging.info("Class map: %s", class_map)
     return class_map
 
 
+def _contains_image(folder):
+    """
+    Checks if the folder contains at least one image, stops at the first one found.
+    """
+    with os.scandir(folder) as entries:
+        return any(entry.name.lower().endswith(("jpg", "jpeg", "png")) for entry in entries)
+
+
 def extract_class_mapping_df(df: pd.DataFrame, class_col: str = "class") -> dict:
     """Creates a class mapping based on the unique values in the class column. 
     
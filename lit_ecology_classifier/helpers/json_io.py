@@ -0,0 +1,47 @@
+"""
+Reading and writing of the JSON files of the package, e.g. class maps, class definitions and shard manifests.
+
+orjson parses and serializes several times faster than the json module of the standard library,
+which matters for large class maps and manifests. It is optional, without it the standard library is used.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def load_json(path: str):
+    """
+    Loads the content of a JSON file.
+
+    Args:
+        path (str): Path to the JSON file.
+
+    Returns:
+        The deserialized content of the file.
+    """
+    if orjson is not None:
+        with open(path, "rb") as file:
+            return orjson.loads(file.read())
+    with open(path) as file:
+        return json.load(file)
+
+
+def dump_json(obj, path: str, indent: bool = False):
+    """
+    Writes an object to a JSON file.
+
+    Args:
+        obj: The object to serialize, dictionaries need string keys.
+        path (str): Path to the JSON file.
+        indent (bool): Indent the file by two spaces to keep it readable.
+    """
+    if orjson is not None:
+        with open(path, "wb") as file:
+            file.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0))
+        return
+    with open(path, "w") as file:
+        json.dump(obj, file, indent=2 if indent else None)
@@ -2,11 +2,9 @@
 # IMPORTS #
 ###########
 import logging
-import json
 from lightning.pytorch.strategies import DDPStrategy
 import pathlib
 import sys
-import json
 from time import time
 
 import lightning as l
@@ -18,7 +16,8 @@ from lightning.pytorch.loggers import CSVLogger, WandbLogger
 from .data.datamodule import DataModule
 from .helpers.argparser import argparser
 from .helpers.calc_class_weights import calculate_class_weights
-from .helpers.helpers import setup_callbacks
+from .helpers.helpers import default_precision, setup_callbacks
+from .helpers.json_io import load_json
 from .models.model import LitClassifier
 
 # Start timing the script
@@ -46,17 +45,15 @@ if __name__ == "__main__":
     logging.info(args)
     if isinstance(args.priority_classes, str):
         if args.priority_classes!="":
-            with open(args.priority_classes) as file:
-                priority_class=json.load(file)["priority_classes"]
-                args.priority_classes=priority_class
+            priority_class=load_json(args.priority_classes)["priority_classes"]
+            args.priority_classes=priority_class
         else:
             args.priority_classes=[]
     
     if isinstance(args.rest_classes, str):
         if args.rest_classes!="":
-            with open(args.rest_classes) as file:
-                rest=json.load(file)["rest_classes"]
-                args.rest_classes=rest
+            rest=load_json(args.rest_classes)["rest_classes"]
+            args.rest_classes=rest
         else:
             args.rest_classes=[]
 
@@ -93,7 +90,13 @@ if __name__ == "__main__":
     else:
         logger = CSVLogger(save_dir=args.train_outpath, name='csv_logs')
 
-    torch.backends.cudnn.allow_tf32 = False
+    # TF32 tensor cores for the float32 matmuls and convolutions outside of autocast
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    precision = args.precision or default_precision(args.no_gpu)
+    logging.info(f"Training with {precision} precision.")
+    # All batches have the same shape, let cuDNN pick the fastest convolution algorithms once
+    torch.backends.cudnn.benchmark = True
 
 
     args.num_classes = len(datamodule.class_map)
@@ -112,7 +115,9 @@ if __name__ == "__main__":
         callbacks=[pl.callbacks.ModelCheckpoint(filename="best_model_acc_stage1", monitor="val_acc", mode="max"),LearningRateMonitor(logging_interval='step')],
         check_val_every_n_epoch=max(args.max_epochs // 8,1),
         devices=gpus,
-        strategy= "ddp" if gpus > 1 else "auto" ,
+        # The graph is the same in every step, which lets DDP reuse its gradient buckets
+        strategy=DDPStrategy(find_unused_parameters=False, static_graph=True) if gpus > 1 else "auto",
+        precision=precision,
         enable_progress_bar=False,
         default_root_dir=args.train_outpath,
     )
@@ -124,17 +129,10 @@ if __name__ == "__main__":
     # sets up callbacks for stage 2
     callbacks = setup_callbacks(args.priority_classes, "best_model_acc_stage2")
 
-    trainer = pl.Trainer(
-        logger=logger,
-        max_epochs=2 * args.max_epochs,
-        log_every_n_steps=40,
-        callbacks=callbacks,
-        check_val_every_n_epoch=max(args.max_epochs // 8,1),
-        devices=gpus,
-        strategy="ddp" if gpus > 1 else "auto",
-        enable_progress_bar=False,
-        default_root_dir=args.train_outpath,
-    )
+    # Reuse the trainer of the first stage, so that DDP and the loggers are not initialized again.
+    # The second stage trains for another 2 * max_epochs epochs with a new optimizer and the stage 2 callbacks
+    trainer.fit_loop.max_epochs = trainer.current_epoch + 2 * args.max_epochs
+    trainer.callbacks = callbacks
     trainer.fit(model, datamodule=datamodule)
 
     # Calculate and log the total time taken for training
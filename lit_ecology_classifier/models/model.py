@@ -9,6 +9,8 @@ from sklearn.metrics import balanced_accuracy_score, f1_score, accuracy_score
 
 from ..helpers.helpers import CosineWarmupScheduler, gmean, output_results, plot_confusion_matrix, plot_loss_acc, plot_score_distributions, FocalLoss, setup_classmap, compute_roc_auc, compute_macro_precision_recall, compute_roc_auc_binary
 from ..models.setup_model import setup_model
+from ..data.transforms import FusedNormalize, RandomFlipRotateBatch, decode_image_batch
+import kornia.augmentation as K
 
 class LitClassifier(LightningModule):
     def __init__(self, **hparams):
@@ -29,20 +31,34 @@ class LitClassifier(LightningModule):
         self.inverted_class_map = dict(sorted({v: k for k, v in self.class_map.items()}.items()))
         self.model = setup_model(**self.hparams)
         self.loss = torch.nn.CrossEntropyLoss() if not "loss" in list(self.hparams) or not self.hparams.loss=="focal" else FocalLoss(alpha=None ,gamma=1.75)
+        # Augmentation and normalization of the uint8 batches on the GPU
+        mean, std = [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]  # ImageNet mean and std
+        # Flip and rotation of the GPU decoded batches, the range of the rotation is taken from the dataset in setup
+        self.gpu_train_transforms = RandomFlipRotateBatch(180)
+        # Batched replacement of the per sample AugMix of the datasets. The augmentations have no
+        # buffers, so the state dict and therefore existing checkpoints stay unchanged
+        self.gpu_augment = K.AugmentationSequential(
+            K.ColorJitter(0.3, 0.3, 0.3, 0.0, p=0.8),
+            K.RandomAffine(degrees=0, translate=(0.1, 0.1), shear=10, p=0.5),
+            K.RandomAutoContrast(p=0.2),
+            K.RandomEqualize(p=0.2),
+        )
+        self.gpu_normalize = FusedNormalize(mean, std)
+        self.gpu_normalize_float = FusedNormalize(mean, std, max_value=1.0)
         logging.info("Model initialized with hyperparameters:\n {}".format(pprint.pformat(self.hparams)))
 
     def TTA(self, batch):
         """
         Perform Test Time Augmentation (TTA) on the input batch.
+        The four rotations of the images are created on the device with torch.rot90.
         Args:
-            batch (tuple): Input batch containing images and labels.
+            batch (torch.Tensor): Input batch of normalized images.
         Returns:
             torch.Tensor: Geometrics Average of probabilities from the TTA predictions.
             torch.Tensor: True labels if batch is list containg true labels as second entry else None.
         """
-
-
-        x = torch.cat([batch[str(i * 90)] for i in range(4)], dim=0)
+        x = torch.cat([torch.rot90(batch, k, dims=(2, 3)) for k in range(4)], dim=0)
+        x = x.contiguous(memory_format=torch.channels_last)
         logits = self(x).softmax(dim=1)
         logits = torch.stack(torch.chunk(logits, 4, dim=0))
         logits = gmean(logits, dim=0)
@@ -58,6 +74,19 @@ class LitClassifier(LightningModule):
         """
         return self.model(x)
 
+    def setup(self, stage: str):
+        """
+        Store the weights of the model in the channels_last (NHWC) memory format, in which the
+        convolutions run on the Tensor Cores without reordering their inputs and outputs.
+        The GPU decoded training batches are rotated by the same range as the training dataset.
+        Args:
+            stage (str): Stage of the trainer (fit, validate, test or predict).
+        """
+        self.model = self.model.to(memory_format=torch.channels_last)
+        datamodule = getattr(self.trainer, "datamodule", None)
+        if datamodule is not None:
+            self.gpu_train_transforms = RandomFlipRotateBatch(datamodule.rotation_degrees)
+
     def configure_optimizers(self):
         """
         Configure optimizers and learning rate schedulers.
@@ -68,7 +97,9 @@ class LitClassifier(LightningModule):
 
         optimizer = torch.optim.AdamW(self.model.parameters(), lr=self.hparams.lr)
 
-        scheduler = CosineWarmupScheduler(optimizer, warmup=3 * len(self.datamodule.train_dataloader()), max_iters=self.trainer.max_epochs * len(self.datamodule.train_dataloader()))
+        # The trainer may be reused from a previous stage, the schedule only spans the remaining epochs
+        remaining_epochs = self.trainer.max_epochs - self.trainer.current_epoch
+        scheduler = CosineWarmupScheduler(optimizer, warmup=3 * len(self.datamodule.train_dataloader()), max_iters=remaining_epochs * len(self.datamodule.train_dataloader()))
         lr_scheduler_config = {
             "scheduler": scheduler,
             "interval": "step",
@@ -86,6 +117,47 @@ class LitClassifier(LightningModule):
         self.hparams.TTA = self.datamodule.TTA
 
 
+    def on_before_batch_transfer(self, batch, dataloader_idx):
+        """
+        Decode the raw JPEG bytes of the batch on the device of the model, if the DataLoader
+        did not decode them (see gpu_decode_collate_fn). decode_jpeg expects its input on the CPU,
+        therefore this happens before the batch is transferred.
+        Args:
+            batch (tuple): Input batch containing a list of images and labels.
+            dataloader_idx (int): Index of the dataloader.
+        Returns:
+            tuple: Batch containing the decoded uint8 images and labels.
+        """
+        if isinstance(batch, (tuple, list)) and isinstance(batch[0], list):
+            x = decode_image_batch(batch[0], self.device)
+            if self.trainer.training:
+                x = self.gpu_train_transforms(x)
+            batch = [x, batch[1]]
+        return batch
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        """
+        Augment and normalize the uint8 images of the batch on the device of the model. Training batches
+        pass the Kornia augmentation first, all other batches are only normalized. Batches normalized by the
+        DataLoader are not normalized again. The images are returned in the channels_last memory format of the model.
+        Args:
+            batch (tuple): Input batch containing images and labels, or only images for prediction.
+            dataloader_idx (int): Index of the dataloader.
+        Returns:
+            tuple: Batch containing the normalized images and labels.
+        """
+        if isinstance(batch, torch.Tensor):
+            return batch.contiguous(memory_format=torch.channels_last)
+        if isinstance(batch, (tuple, list)) and isinstance(batch[0], torch.Tensor):
+            x = batch[0].as_subclass(torch.Tensor)
+            if x.dtype == torch.uint8:
+                if self.trainer.training:
+                    x = self.gpu_normalize_float(self.gpu_augment(x.float().div_(255)))
+                else:
+                    x = self.gpu_normalize(x)
+            batch = [x.contiguous(memory_format=torch.channels_last), batch[1]]
+        return batch
+
     def training_step(self, batch, batch_idx):
         """
         Perform a training step.
@@ -295,7 +367,8 @@ class LitClassifier(LightningModule):
         Hook to be called at the end of the test epoch.
         Saves predicted labels in text file in folder Output
         """
-        filenames = self.datamodule.predict_dataset.image_infos
+        predict_dataset = self.datamodule.predict_dataset
+        filenames = predict_dataset.names if self.hparams.datapath.find(".tar") != -1 else predict_dataset.image_infos
         max_index = torch.cat(self.probabilities).argmax(axis=1)
 
         pred_label = np.array([self.inverted_class_map[idx] for idx in max_index.numpy()], dtype=object)
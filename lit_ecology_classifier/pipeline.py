@@ -18,7 +18,7 @@ from lightning.pytorch.loggers import CSVLogger, WandbLogger
 from lit_ecology_classifier.data.datamodule import DataModule
 from lit_ecology_classifier.helpers.argparser import pipeline_argparser
 from lit_ecology_classifier.helpers.calc_class_weights import calculate_class_weights
-from lit_ecology_classifier.helpers.helpers import setup_callbacks
+from lit_ecology_classifier.helpers.helpers import default_precision, setup_callbacks
 from lit_ecology_classifier.models.model import LitClassifier
 from lit_ecology_classifier.splitting.split_processor import SplitProcessor
 
@@ -71,10 +71,8 @@ if __name__ == "__main__":
                        for class_, class_map in zip(split_overview["class"], split_overview["class_map"])}
 
     
-    gpus =torch.cuda.device_count() if not args.no_gpu else 1
+    gpus =torch.cuda.device_count() if not args.no_gpu else 0
     logging.info(f"Using {gpus} GPUs for training.")
-    
-    gpus = 1
 
     datamodule = DataModule(**vars(args), splits=split_overview)
     datamodule.setup("fit")
@@ -96,7 +94,13 @@ if __name__ == "__main__":
     else:
         logger = CSVLogger(save_dir=args.train_outpath, name='csv_logs')
 
-    torch.backends.cudnn.allow_tf32 = False
+    # TF32 tensor cores for the float32 matmuls and convolutions outside of autocast
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    precision = args.precision or default_precision(args.no_gpu)
+    logging.info(f"Training with {precision} precision.")
+    # All batches have the same shape, let cuDNN pick the fastest convolution algorithms once
+    torch.backends.cudnn.benchmark = True
 
     args.num_classes = len(datamodule.class_map)
     if args.balance_classes:
@@ -115,8 +119,11 @@ if __name__ == "__main__":
         log_every_n_steps=40,
         callbacks=[pl.callbacks.ModelCheckpoint(filename="best_model_acc_stage1", monitor="val_acc", mode="max"),LearningRateMonitor(logging_interval='step')],
         check_val_every_n_epoch=max(args.max_epochs // 8,1),
-        devices=gpus,
-        strategy= "ddp" if gpus > 0 else "auto" ,
+        accelerator="gpu" if gpus > 0 else "cpu",
+        devices=max(gpus, 1),
+        # The graph is the same in every step, which lets DDP reuse its gradient buckets
+        strategy=DDPStrategy(find_unused_parameters=False, static_graph=True) if gpus > 1 else "auto",
+        precision=precision,
         enable_progress_bar=False,
         default_root_dir=args.train_outpath,
     )
@@ -131,17 +138,10 @@ if __name__ == "__main__":
     # sets up callbacks for stage 2
     callbacks = setup_callbacks(args.priority_classes, "best_model_acc_stage2")
 
-    trainer = pl.Trainer(
-        logger=logger,
-        max_epochs=2 * args.max_epochs,
-        log_every_n_steps=40,
-        callbacks=callbacks,
-        check_val_every_n_epoch=max(args.max_epochs // 8,1),
-        devices=gpus,
-        strategy="ddp" if gpus > 0 else "auto",
-        enable_progress_bar=False,
-        default_root_dir=args.train_outpath,
-    )
+    # Reuse the trainer of the first stage, so that DDP and the loggers are not initialized again.
+    # The second stage trains for another 2 * max_epochs epochs with a new optimizer and the stage 2 callbacks
+    trainer.fit_loop.max_epochs = trainer.current_epoch + 2 * args.max_epochs
+    trainer.callbacks = callbacks
     trainer.fit(model, datamodule=datamodule)
 
     # Calculate and log the total time taken for training
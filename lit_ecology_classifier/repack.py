@@ -0,0 +1,38 @@
+"""
+Script to repack the tar file of a dataset once into shards of about 1 GB.
+
+Training on the shards reads the images strictly sequentially, instead of seeking to every image
+inside one large tar file, which is much faster on network file systems and HDDs. The images are
+shuffled into the shards and the manifest stores their index in the tar file, so the random split
+of the training is the same as with the tar file.
+
+Example cmd:
+
+python -m lit_ecology_classifier.repack --datapath data/phyto.tar --outpath data/phyto_shards
+
+Afterwards, pass the shard directory as --datapath to main.py.
+"""
+import logging
+import sys
+from time import time
+
+from lit_ecology_classifier.data.sharded_dataset import repack_tar
+from lit_ecology_classifier.helpers.argparser import repack_argparser
+
+# Start timing the script
+time_begin = time()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - -%(message)s")
+
+if __name__ == "__main__":
+    print("\nRunning", sys.argv[0], sys.argv[1:])
+
+    parser = repack_argparser()
+    args = parser.parse_args()
+    logging.info(args)
+
+    repack_tar(args.datapath, args.outpath, shard_size=int(args.shard_size * 1e9))
+
+    total_secs = -1 if time_begin is None else (time() - time_begin)
+    logging.info("Time taken for repacking (in secs): {}".format(total_secs))
@@ -22,6 +22,7 @@ setup(
         'pandas',
         'matplotlib',
         'timm',
+        'kornia',
         'safetensors',
         'scikit-learn'
         # Add other dependencies here
@@ -0,0 +1,40 @@
+import os
+import tarfile
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# Three classes with a mix of JPEG and PNG images of different sizes
+CLASS_MAP = {"aphanizomenon": 0, "daphnia": 1, "rotifers": 2}
+IMAGES_PER_CLASS = 4
+
+
+@pytest.fixture
+def class_map():
+    return dict(CLASS_MAP)
+
+
+@pytest.fixture
+def image_dir(tmp_path):
+    """Folder with one sub folder of images per class."""
+    data_dir = tmp_path / "images"
+    rng = np.random.default_rng(0)
+    for class_name in CLASS_MAP:
+        os.makedirs(data_dir / class_name)
+        for i in range(IMAGES_PER_CLASS):
+            array = rng.integers(0, 255, size=(40 + 10 * i, 60, 3), dtype=np.uint8)
+            extension = "png" if i == 0 else "jpg"
+            Image.fromarray(array).save(data_dir / class_name / f"{class_name}_{i}.{extension}")
+    return data_dir
+
+
+@pytest.fixture
+def image_tar(tmp_path, image_dir):
+    """Tar file with the members images/<class>/<image>, the layout of the training tar files."""
+    tar_path = tmp_path / "images.tar"
+    with tarfile.open(tar_path, "w") as tar:
+        for class_name in sorted(CLASS_MAP):
+            for file_name in sorted(os.listdir(image_dir / class_name)):
+                tar.add(image_dir / class_name / file_name, arcname=f"images/{class_name}/{file_name}")
+    return str(tar_path)
@@ -0,0 +1,31 @@
+import os
+
+import pandas as pd
+import torch
+
+from lit_ecology_classifier.data.dataframe_dataset import DataFrameDataset
+
+
+def image_overview(image_dir, class_map):
+    rows = [
+        {"image": file_name, "class": class_name, "class_map": label}
+        for class_name, label in class_map.items()
+        for file_name in sorted(os.listdir(image_dir / class_name))
+    ]
+    return pd.DataFrame(rows)
+
+
+# Test the image cache of the DataFrameDataset ---------------------------------------------------
+
+def test_dataframe_dataset_reads_cached_images(image_dir, class_map, tmp_path, monkeypatch):
+    dataset = DataFrameDataset(image_overview(image_dir, class_map), str(image_dir), train=False, class_map=class_map, image_cache=str(tmp_path / "cache.val"))
+    first_epoch = [dataset[idx] for idx in range(len(dataset))]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The image was decoded although it is cached.")
+    monkeypatch.setattr(dataset, "_decode_image", fail)
+    second_epoch = [dataset[idx] for idx in range(len(dataset))]
+
+    for (image, label), (cached_image, cached_label) in zip(first_epoch, second_epoch):
+        assert torch.equal(image, cached_image)
+        assert label == cached_label
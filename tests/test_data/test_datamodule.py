@@ -0,0 +1,45 @@
+import pytest
+
+import lit_ecology_classifier.data.datamodule as datamodule
+from lit_ecology_classifier.data.datamodule import DataModule
+
+
+# Test the default number of read threads --------------------------------------------------------
+
+@pytest.mark.parametrize(
+    ("num_workers", "read_threads", "expected_output"),
+    [
+        # the default workers use all CPUs, one thread each
+        (None, None, 1),
+
+        # the idle CPUs are split between the workers
+        (4, None, 4),
+        (0, None, 16),
+
+        # an explicit value is kept
+        (None, 8, 8),
+    ]
+)
+
+
+def test_default_read_threads(monkeypatch, num_workers, read_threads, expected_output):
+    monkeypatch.setattr(datamodule, "available_cpus", lambda: 32)
+    monkeypatch.setattr(datamodule.torch.cuda, "device_count", lambda: 2)
+
+    module = DataModule("data.tar", 16, "phyto", num_workers=num_workers, read_threads=read_threads)
+
+    assert module.read_threads == expected_output
+
+
+# Test the image cache settings ------------------------------------------------------------------
+
+def test_image_cache_disabled_with_gpu_decode():
+    module = DataModule("data.tar", 16, "phyto", image_cache="cache.bin", gpu_decode=True)
+
+    assert module.image_cache is None
+
+
+def test_image_cache_per_split():
+    module = DataModule("data", 16, "phyto", image_cache="cache.bin")
+
+    assert [module._split_cache_path(split) for split in ("train", "val", "test")] == ["cache.bin.train", "cache.bin.val", "cache.bin.test"]
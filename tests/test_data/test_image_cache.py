@@ -0,0 +1,57 @@
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from lit_ecology_classifier.data.image_cache import ImageCache
+
+
+class CountingDataset(Dataset):
+    """Dataset of random images, which marks the images it had to create instead of reading them from the cache."""
+
+    def __init__(self, cache_path, num_images):
+        self.num_images = num_images
+        self.image_cache = ImageCache(cache_path, num_images, image_size=(8, 8))
+
+    def __len__(self):
+        return self.num_images
+
+    def __getitem__(self, idx):
+        image = self.image_cache.get(idx)
+        if image is not None:
+            return image.as_subclass(torch.Tensor), False
+        image = torch.full((3, 8, 8), idx, dtype=torch.uint8)
+        self.image_cache.put(idx, image)
+        return image, True
+
+
+# Test the ImageCache ----------------------------------------------------------------------------
+
+def test_image_cache_round_trip(tmp_path):
+    cache = ImageCache(str(tmp_path / "cache.bin"), 4, image_size=(8, 8))
+    image = torch.randint(0, 256, (3, 8, 8), dtype=torch.uint8)
+
+    assert cache.get(1) is None
+    cache.put(1, image)
+
+    assert torch.equal(cache.get(1), image)
+    assert cache.get(0) is None
+
+
+def test_image_cache_shared_between_worker_epochs(tmp_path):
+    dataset = CountingDataset(str(tmp_path / "cache.bin"), 12)
+    # The workers are started again every epoch, the images cached by the workers of one epoch are read in the next
+    loader = DataLoader(dataset, batch_size=3, num_workers=2, shuffle=True)
+
+    first_epoch = [(images, created) for images, created in loader]
+    second_epoch = [(images, created) for images, created in loader]
+
+    assert all(created.all() for _, created in first_epoch)
+    assert not any(created.any() for _, created in second_epoch)
+    for images, _ in second_epoch:
+        assert all(torch.all(image == image[0, 0, 0]) for image in images)
+
+
+def test_image_cache_rows_not_trusted_in_new_run(tmp_path):
+    cache_path = str(tmp_path / "cache.bin")
+    ImageCache(cache_path, 4, image_size=(8, 8)).put(0, torch.ones(3, 8, 8, dtype=torch.uint8))
+
+    assert ImageCache(cache_path, 4, image_size=(8, 8)).get(0) is None
@@ -0,0 +1,53 @@
+import os
+import shutil
+
+from lit_ecology_classifier.data.imagedataset import ImageFolderDataset
+
+
+def relative_paths(dataset):
+    return sorted(os.path.relpath(path, dataset.data_dir) for path in dataset.image_infos)
+
+
+# Test the index file of the ImageFolderDataset --------------------------------------------------
+
+def test_folder_index_is_reused(image_dir, class_map, monkeypatch):
+    dataset = ImageFolderDataset(str(image_dir), class_map, [], [])
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The folders were scanned although the index is up to date.")
+    monkeypatch.setattr(ImageFolderDataset, "_scan_class_folders", fail)
+    reloaded = ImageFolderDataset(str(image_dir), class_map, [], [])
+
+    assert reloaded.image_infos == dataset.image_infos
+
+
+# The label is the name of the parent folder, therefore the nested folders are named after their class
+def test_folder_index_sees_new_nested_image(image_dir, class_map):
+    os.makedirs(image_dir / "daphnia" / "daphnia")
+    ImageFolderDataset(str(image_dir), class_map, [], [])
+
+    shutil.copy(image_dir / "daphnia" / "daphnia_1.jpg", image_dir / "daphnia" / "daphnia" / "new.jpg")
+    dataset = ImageFolderDataset(str(image_dir), class_map, [], [])
+
+    assert os.path.join("daphnia", "daphnia", "new.jpg") in relative_paths(dataset)
+
+
+def test_folder_index_sees_removed_nested_image(image_dir, class_map):
+    os.makedirs(image_dir / "daphnia" / "daphnia")
+    shutil.move(image_dir / "daphnia" / "daphnia_1.jpg", image_dir / "daphnia" / "daphnia" / "daphnia_1.jpg")
+    ImageFolderDataset(str(image_dir), class_map, [], [])
+
+    os.remove(image_dir / "daphnia" / "daphnia" / "daphnia_1.jpg")
+    dataset = ImageFolderDataset(str(image_dir), class_map, [], [])
+
+    assert os.path.join("daphnia", "daphnia", "daphnia_1.jpg") not in relative_paths(dataset)
+    for idx in range(len(dataset)):
+        dataset[idx]
+
+
+def test_folder_scan_skips_symlink_loop(image_dir, class_map):
+    os.symlink(image_dir / "daphnia", image_dir / "daphnia" / "loop")
+
+    dataset = ImageFolderDataset(str(image_dir), class_map, [], [])
+
+    assert len(dataset) == len(class_map) * 4
@@ -0,0 +1,44 @@
+import os
+
+from lit_ecology_classifier.data.index_file import index_path_for, load_index, save_index
+
+
+# Test the index file ----------------------------------------------------------------------------
+
+def test_index_path_next_to_dataset(tmp_path):
+    assert index_path_for(str(tmp_path / "images") + "/") == str(tmp_path / "images.index.pkl")
+    assert index_path_for(str(tmp_path / "phyto.tar")) == str(tmp_path / "phyto.tar.index.pkl")
+
+
+def test_index_round_trip(tmp_path):
+    data_path = str(tmp_path / "phyto.tar")
+    index = (["a/b/1.jpg"], [512], [1024])
+
+    assert load_index(data_path, 0.0) is None
+    save_index(data_path, index)
+
+    assert load_index(data_path, os.path.getmtime(index_path_for(data_path))) == index
+    assert not any(name.endswith(".tmp") for name in os.listdir(tmp_path))
+
+
+def test_index_older_than_dataset_is_stale(tmp_path):
+    data_path = str(tmp_path / "phyto.tar")
+    save_index(data_path, ["a/b/1.jpg"])
+
+    assert load_index(data_path, os.path.getmtime(index_path_for(data_path)) + 1) is None
+
+
+def test_corrupt_index_is_ignored(tmp_path):
+    data_path = str(tmp_path / "phyto.tar")
+    with open(index_path_for(data_path), "wb") as file:
+        file.write(b"not a pickle")
+
+    assert load_index(data_path, 0.0) is None
+
+
+def test_unwritable_index_is_skipped(tmp_path):
+    data_path = str(tmp_path / "missing" / "phyto.tar")
+
+    save_index(data_path, ["a/b/1.jpg"])
+
+    assert load_index(data_path, 0.0) is None
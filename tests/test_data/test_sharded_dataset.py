@@ -0,0 +1,153 @@
+import copy
+import math
+import os
+import random
+import tarfile
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+import lit_ecology_classifier.data.sharded_dataset as sharded_dataset
+from lit_ecology_classifier.data.datamodule import DataModule
+from lit_ecology_classifier.data.sharded_dataset import ShardedTarDataset, repack_tar
+from lit_ecology_classifier.data.tardataset import TarImageDataset
+
+
+@pytest.fixture
+def shard_dir(tmp_path, image_tar):
+    """Shards of the image tar file with a few images each."""
+    shard_dir = str(tmp_path / "shards")
+    repack_tar(image_tar, shard_dir, shard_size=5000)
+    return shard_dir
+
+
+def iterate_worker(monkeypatch, dataset, rank, world_size, worker_id, num_workers):
+    """
+    Iterates a copy of the dataset as the given DataLoader worker of the given DDP process.
+    The JPEG images are identified by their raw bytes.
+    """
+    monkeypatch.setattr(ShardedTarDataset, "_get_rank", staticmethod(lambda: (rank, world_size)))
+    # The workers of a process are seeded with the same base seed plus their id
+    worker_info = SimpleNamespace(id=worker_id, num_workers=num_workers, seed=1234 + worker_id)
+    monkeypatch.setattr(sharded_dataset, "get_worker_info", lambda: worker_info)
+    return [bytes(image.numpy()) for image, _ in copy.copy(dataset)]
+
+
+# Test the equal number of batches of the DDP processes ------------------------------------------
+
+@pytest.mark.parametrize("world_size", [1, 2])
+@pytest.mark.parametrize("num_workers", [1, 2, 3])
+@pytest.mark.parametrize("batch_size", [1, 2, 4])
+@pytest.mark.parametrize("drop_last", [False, True])
+def test_sharded_equal_batches_per_rank(monkeypatch, shard_dir, class_map, world_size, num_workers, batch_size, drop_last):
+    dataset = ShardedTarDataset(shard_dir, class_map, [], [], train=True, gpu_decode=True, shuffle_buffer=3, batch_size=batch_size)
+    assert len(dataset.shards) >= 2
+
+    batches, images = [], []
+    for rank in range(world_size):
+        monkeypatch.setattr(ShardedTarDataset, "_get_rank", staticmethod(lambda: (rank, world_size)))
+        length = len(dataset)
+        worker_images = [iterate_worker(monkeypatch, dataset, rank, world_size, worker_id, num_workers) for worker_id in range(num_workers)]
+        # Every worker of a DataLoader batches its own images
+        round_batches = math.floor if drop_last else math.ceil
+        batches.append(sum(round_batches(len(worker) / batch_size) for worker in worker_images))
+        images.extend(image for worker in worker_images for image in worker)
+        assert sum(len(worker) for worker in worker_images) == length
+
+    assert len(set(batches)) == 1
+    assert batches[0] == (length // batch_size if drop_last else math.ceil(length / batch_size))
+    assert len(images) == len(set(images))
+    if world_size == 1:
+        assert len(images) == len(dataset.labels)
+
+
+@pytest.mark.parametrize("world_size", [1, 2, 5])
+@pytest.mark.parametrize("num_workers", [1, 2])
+@pytest.mark.parametrize("batch_size", [1, 4])
+def test_sharded_evaluation_covers_all_images(monkeypatch, shard_dir, class_map, world_size, num_workers, batch_size):
+    dataset = ShardedTarDataset(shard_dir, class_map, [], [], train=False, gpu_decode=True, batch_size=batch_size)
+    num_images = len(dataset.labels)
+
+    batches, images = [], []
+    for rank in range(world_size):
+        monkeypatch.setattr(ShardedTarDataset, "_get_rank", staticmethod(lambda: (rank, world_size)))
+        length = len(dataset)
+        worker_images = [iterate_worker(monkeypatch, dataset, rank, world_size, worker_id, num_workers) for worker_id in range(num_workers)]
+        batches.append(sum(math.ceil(len(worker) / batch_size) for worker in worker_images))
+        images.extend(image for worker in worker_images for image in worker)
+        assert sum(len(worker) for worker in worker_images) == length == math.ceil(num_images / world_size)
+
+    # Every image is evaluated, only the padding of the last round repeats images
+    assert len(set(batches)) == 1
+    assert len(set(images)) == num_images
+    assert len(images) == math.ceil(num_images / world_size) * world_size
+
+
+# Test the repacking into shards -----------------------------------------------------------------
+
+def tar_indices(shard_dir):
+    """Index in the tar file of every image of the shards, in the order of the shards."""
+    return np.concatenate([shard["indices"] for shard in sharded_dataset.load_manifest(shard_dir)["shards"]])
+
+
+def test_repack_shuffles_images(shard_dir, image_tar, class_map):
+    tar_dataset = TarImageDataset(image_tar, class_map, [], [], train=True)
+    manifest = sharded_dataset.load_manifest(shard_dir)
+    indices = tar_indices(shard_dir)
+
+    assert len(manifest["shards"]) > 1
+    assert sorted(indices) == list(range(len(tar_dataset)))
+    names = []
+    for shard in manifest["shards"]:
+        with tarfile.open(os.path.join(shard_dir, shard["url"])) as tar:
+            names.extend(tar.getnames())
+    assert names == [tar_dataset.names[index] for index in indices]
+    # The classes of the tar file are sorted, the classes of the shards are mixed
+    class_ids = [class_id for shard in manifest["shards"] for class_id in shard["class_ids"]]
+    assert class_ids == [class_map[tar_dataset.names[index].split("/")[1]] for index in indices]
+    assert class_ids != sorted(class_ids)
+
+
+def test_sharded_images_match_tar_dataset(shard_dir, image_tar, class_map):
+    tar_dataset = TarImageDataset(image_tar, class_map, [], [], train=True)
+    tar_dataset.train = False
+    dataset = ShardedTarDataset(shard_dir, class_map, [], [], train=False)
+
+    # The dataset positions follow the tar file, the images are read in the order of the shards
+    np.testing.assert_array_equal(dataset.labels, tar_dataset.labels)
+    samples = list(dataset)
+    assert len(samples) == len(tar_dataset)
+    for (image, label), index in zip(samples, tar_indices(shard_dir)):
+        assert torch.equal(image, tar_dataset[index])
+        assert label == tar_dataset.labels[index]
+
+
+def test_sharded_split_matches_tar_split(shard_dir, image_tar, class_map):
+    splits = [0.5, 0.25]
+    tar_module = DataModule(image_tar, 2, "phyto", class_map=class_map, splits=splits, num_workers=0)
+    tar_module.setup("fit")
+    shard_module = DataModule(shard_dir, 2, "phyto", class_map=class_map, splits=splits, num_workers=0)
+    shard_module.setup("fit")
+
+    indices = tar_indices(shard_dir)
+    for tar_split, shard_split in [
+        (tar_module.train_dataset, shard_module.train_dataset),
+        (tar_module.val_dataset, shard_module.val_dataset),
+        (tar_module.test_dataset, shard_module.test_dataset),
+    ]:
+        assert sorted(tar_split.indices) == indices[shard_split._indices].tolist()
+    assert shard_module.train_dataset.train and not shard_module.val_dataset.train
+
+
+def test_interleave_keeps_every_image_once(shard_dir, class_map):
+    dataset = ShardedTarDataset(shard_dir, class_map, [], [], interleave_shards=2)
+    readers = [iter([1, 2, 3]), iter([4]), iter([5, 6]), iter([7, 8, 9])]
+
+    interleaved = list(dataset._interleave(readers, random.Random(0)))
+
+    assert sorted(interleaved) == list(range(1, 10))
+    # Each reader is still read in its own order
+    for reader in ([1, 2, 3], [5, 6], [7, 8, 9]):
+        assert [image for image in interleaved if image in reader] == reader
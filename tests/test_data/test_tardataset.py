@@ -0,0 +1,80 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from lit_ecology_classifier.data.index_file import index_path_for, save_index
+from lit_ecology_classifier.data.tardataset import PackedNames, TarImageDataset
+
+NAMES = ["a/b/1.jpg", "a/ü/2.png", "", "c/3.jpeg"]
+
+
+# Test the PackedNames ---------------------------------------------------------------------------
+
+def test_packed_names_sequence():
+    names = PackedNames(NAMES)
+
+    assert len(names) == len(NAMES)
+    assert list(names) == NAMES
+    assert [names[i] for i in range(len(NAMES))] == NAMES
+
+
+@pytest.mark.parametrize("idx", [-1, -4, 1, slice(1, 3), slice(None, None, -1), slice(10, 20)])
+def test_packed_names_indexing_matches_list(idx):
+    assert PackedNames(NAMES)[idx] == NAMES[idx]
+
+
+@pytest.mark.parametrize("idx", [4, -5])
+def test_packed_names_out_of_range(idx):
+    with pytest.raises(IndexError):
+        PackedNames(NAMES)[idx]
+
+
+def test_packed_names_select_and_pickle():
+    names = PackedNames(NAMES)
+    selected = names.select(np.array([True, False, True, True]))
+
+    assert list(selected) == [NAMES[0], NAMES[2], NAMES[3]]
+    assert list(pickle.loads(pickle.dumps(names))) == NAMES
+
+
+# Test the index file of the TarImageDataset -----------------------------------------------------
+
+def test_tar_index_round_trip(image_tar, class_map, monkeypatch):
+    dataset = TarImageDataset(image_tar, class_map, [], [], train=True)
+    assert os.path.exists(index_path_for(image_tar))
+    assert len(dataset) == len(class_map) * 4
+
+    # The second dataset must not parse the tar file
+    def fail(*args, **kwargs):
+        raise AssertionError("The tar file was parsed although an index exists.")
+    monkeypatch.setattr("lit_ecology_classifier.data.tardataset.tarfile.open", fail)
+    reloaded = TarImageDataset(image_tar, class_map, [], [], train=True)
+
+    assert list(reloaded.names) == list(dataset.names)
+    np.testing.assert_array_equal(reloaded.offsets, dataset.offsets)
+    np.testing.assert_array_equal(reloaded.sizes, dataset.sizes)
+    np.testing.assert_array_equal(reloaded.labels, dataset.labels)
+
+
+def test_tar_index_old_format_is_rebuilt(image_tar, class_map):
+    reference = TarImageDataset(image_tar, class_map, [], [], train=True)
+    # Index of an older version with the names as a list of str
+    save_index(image_tar, (list(reference.names), reference.offsets, reference.sizes))
+
+    dataset = TarImageDataset(image_tar, class_map, [], [], train=True)
+
+    assert isinstance(dataset.names, PackedNames)
+    assert list(dataset.names) == list(reference.names)
+    with open(index_path_for(image_tar), "rb") as file:
+        assert isinstance(pickle.load(file)[0], PackedNames)
+
+
+def test_tar_reads_images_at_offsets(image_tar, class_map):
+    dataset = TarImageDataset(image_tar, class_map, [], [], train=True, TTA=True)
+
+    for idx in range(len(dataset)):
+        image, label = dataset[idx]
+        assert image.shape == (3, 224, 224)
+        assert label == class_map[dataset.names[idx].split("/")[1]]
@@ -0,0 +1,57 @@
+import pytest
+import torch
+from torchvision.transforms.v2 import Normalize, ToDtype
+
+from lit_ecology_classifier.data.transforms import FusedNormalize, RandomFlipRotateBatch
+
+
+def random_batch(n=8, height=32, width=32):
+    return torch.randint(0, 256, (n, 3, height, width), dtype=torch.uint8, generator=torch.Generator().manual_seed(0))
+
+
+# Test the RandomFlipRotateBatch -----------------------------------------------------------------
+
+def test_flip_rotate_without_rotation_only_flips():
+    images = random_batch()
+
+    transformed = RandomFlipRotateBatch(0)(images)
+
+    assert transformed.dtype == torch.uint8 and transformed.shape == images.shape
+    for image, result in zip(images, transformed):
+        assert torch.equal(result, image) or torch.equal(result, image.flip(-1))
+
+
+@pytest.mark.parametrize(("flip_draw", "flip"), [(0.9, False), (0.1, True)])
+def test_flip_rotate_by_90_degrees_matches_rot90(monkeypatch, flip_draw, flip):
+    images = random_batch()
+    # The first draw selects the maximum angle of +90 degrees, the second one the flip
+    draws = iter([torch.ones(len(images)), torch.full((len(images),), flip_draw)])
+    monkeypatch.setattr(torch, "rand", lambda *args, **kwargs: next(draws))
+
+    transformed = RandomFlipRotateBatch(90)(images)
+
+    expected = images.flip(-1) if flip else images
+    rotations = [torch.rot90(expected, k, dims=(2, 3)) for k in (1, 3)]
+    assert any(torch.equal(transformed, rotation) for rotation in rotations)
+
+
+# Test the FusedNormalize ------------------------------------------------------------------------
+
+MEAN, STD = [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]
+
+
+@pytest.mark.parametrize("shape", [(3, 24, 32), (5, 3, 24, 32)])
+def test_fused_normalize_matches_todtype_normalize(shape):
+    images = torch.randint(0, 256, shape, dtype=torch.uint8, generator=torch.Generator().manual_seed(0))
+    reference = Normalize(MEAN, STD)(ToDtype(torch.float32, scale=True)(images))
+
+    normalized = FusedNormalize(MEAN, STD)(images)
+
+    assert normalized.dtype == torch.float32
+    torch.testing.assert_close(normalized, reference)
+
+
+def test_fused_normalize_float_images():
+    images = torch.rand(5, 3, 24, 32, generator=torch.Generator().manual_seed(0))
+
+    torch.testing.assert_close(FusedNormalize(MEAN, STD, max_value=1.0)(images), Normalize(MEAN, STD)(images))
@@ -32,4 +32,42 @@ def test_rest_class_filter(expected_output, priority_classes, rest_classes):
                             class_map= input_class_map,
                             rest_classes= rest_classes,
                             priority_classes= priority_classes) == expected_output
-                                                         
\ No newline at end of file
+                                                         
+
+# Test the default_precision ---------------------------------------------------------------------
+
+@pytest.mark.parametrize(
+    ("cuda_available", "bf16_supported", "no_gpu", "expected_output"),
+    [
+        # Ampere and newer GPUs support bf16 natively
+        (True, True, False, "bf16-mixed"),
+
+        # older GPUs, e.g. V100, only emulate bf16
+        (True, False, False, "16-mixed"),
+
+        # no GPU available or GPU disabled
+        (False, False, False, "32-true"),
+        (True, True, True, "32-true"),
+    ]
+)
+def test_default_precision(monkeypatch, cuda_available, bf16_supported, no_gpu, expected_output):
+
+    monkeypatch.setattr(helpers.torch.cuda, "is_available", lambda: cuda_available)
+    monkeypatch.setattr(helpers.torch.cuda, "is_bf16_supported", lambda including_emulation=True: bf16_supported)
+
+    assert helpers.default_precision(no_gpu) == expected_output
+
+
+# Test the _extract_class_map on folders ---------------------------------------------------------
+
+def test_extract_class_map_from_folder(tmp_path):
+    for class_name, file_name in [("rotifers", "a.jpg"), ("daphnia", "b.PNG"), ("aphanizomenon", "c.jpeg")]:
+        (tmp_path / class_name).mkdir()
+        (tmp_path / class_name / file_name).write_bytes(b"")
+    # folders and files without images are no classes
+    (tmp_path / "empty").mkdir()
+    (tmp_path / "notes").mkdir()
+    (tmp_path / "notes" / "readme.txt").write_text("")
+    (tmp_path / "image.jpg").write_bytes(b"")
+
+    assert helpers._extract_class_map(str(tmp_path)) == {"aphanizomenon": 0, "daphnia": 1, "rotifers": 2}